@@ -1,8 +1,8 @@
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
-from forex_python.converter import CurrencyRates
 from datetime import datetime
+from fx_rates import FXRates
 
 # List of stocks with Google Finance tickers
 data = [
@@ -39,15 +39,13 @@ def get_stock_price(ticker):
         print(f"Error fetching data for {ticker}: {e}")
         return None, None
 
+# Rates to GBP, fetched once per run and kept by day in data/fx_rates.csv
+fx_rates = FXRates()
+
 # Function to get exchange rate
+# Raises an error when there is no recent rate rather than defaulting to 1
 def get_exchange_rate(currency):
-    c = CurrencyRates()
-    try:
-        rate = c.get_rate(currency, 'GBP')
-    except Exception as e:
-        print(f"Error fetching exchange rate for {currency}: {e}")
-        rate = 1  # Default to 1 if there's an issue
-    return rate
+    return fx_rates.rate(currency)
 
 # Initialize list for storing results
 results = []
@@ -56,7 +54,11 @@ results = []
 for stock in data:
     price, currency = get_stock_price(stock['ticker'])
     if price is not None and currency is not None:
-        exch_rate = get_exchange_rate(currency)
+        try:
+            exch_rate = get_exchange_rate(currency)
+        except Exception as e:
+            print(f"Error fetching exchange rate for {currency}: {e}")
+            continue
         value_in_gbp = price * exch_rate
         results.append({
             "isin": stock['isin'],
@@ -66,6 +68,7 @@ for stock in data:
             "price": price,
             "currency": currency,
             "exchangerate_to_gbp": exch_rate,
+            "exchangerate_date": fx_rates.as_of,
             "value_in_gbp": value_in_gbp
         })
 
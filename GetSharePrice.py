@@ -1,7 +1,17 @@
+import time
+import queue
+import threading
 import yfinance as yf
 import pandas as pd
-from forex_python.converter import CurrencyRates
 from datetime import datetime
+from fx_rates import FXRates
+
+# Tickers fetched at once, seconds allowed per attempt, extra attempts
+# after a failure or timeout, and seconds allowed for the whole fetch
+MAX_WORKERS = 8
+FETCH_TIMEOUT = 20
+FETCH_RETRIES = 2
+FETCH_DEADLINE = 120
 
 # List of stocks with Nestle ticker adjusted for Yahoo Finance
 data = [
@@ -54,38 +64,119 @@ data = [
 
 
 # Function to get stock price and currency
-def get_stock_price(ticker, name):
+# The currency comes from the metadata of the price request, so both are
+# bound by the same timeout
+def get_stock_price(ticker, name, timeout=FETCH_TIMEOUT):
     # Hardcode the price for Nestle
     if name == "Nestle":
         return 84.32, "CHF"
     else:
         stock = yf.Ticker(ticker)
-        data = stock.history(period='1d')
+        data = stock.history(period='1d', timeout=timeout)
         if not data.empty:
             price = data['Close'].iloc[0]
-            info = stock.info
-            currency = info.get('currency', 'USD')  # Default to USD if currency is not found
+            metadata = stock.history_metadata or {}
+            currency = metadata.get('currency', 'USD')  # Default to USD if currency is not found
             return price, currency
         else:
             raise ValueError(f"Could not fetch data for {ticker}")
 
+# One try at fetching a stock on its own daemon thread, so a call that
+# never returns is left behind without holding up the exit
+class FetchAttempt:
+    def __init__(self, stock, number, timeout, results):
+        self.stock = stock
+        self.number = number
+        self.timeout = timeout
+        self.results = results
+        self.started = time.monotonic()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        try:
+            outcome = get_stock_price(self.stock['ticker'], self.stock['name'], self.timeout), None
+        except Exception as error:
+            outcome = None, f"{type(error).__name__}: {error}"
+        self.results.put((self, outcome))
+
+    def expired(self, now):
+        return now - self.started > self.timeout
+
+# Fetch the price and currency of every stock, at most max_workers at once
+# Each attempt gets timeout seconds from when it starts and a failed or
+# timed out ticker is tried up to retries more times, once a worker is
+# free. Whatever is unfinished after deadline seconds is reported as timed
+# out, so one slow or bad symbol does not hold up the rest.
+# Returns {ticker: (price, currency, error)} with error None on success
+def fetch_quotes(stocks, max_workers=MAX_WORKERS, timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES,
+                 deadline=FETCH_DEADLINE):
+    quotes = {}
+    waiting = [(stock, 1) for stock in stocks]
+    running = set()
+    results = queue.Queue()
+    end = time.monotonic() + deadline
+
+    def failed(attempt, message):
+        if attempt.number <= retries:
+            waiting.append((attempt.stock, attempt.number + 1))
+        else:
+            quotes[attempt.stock['ticker']] = (None, None, message)
+
+    while waiting or running:
+        now = time.monotonic()
+        if now >= end:
+            break
+
+        while waiting and len(running) < max_workers:
+            stock, number = waiting.pop(0)
+            running.add(FetchAttempt(stock, number, timeout, results))
+
+        # Wait for a result, the next attempt to time out or the deadline
+        wake = min([end] + [attempt.started + timeout for attempt in running])
+        try:
+            attempt, (quote, error) = results.get(timeout=max(wake - time.monotonic(), 0.01))
+        except queue.Empty:
+            attempt = None
+
+        if attempt in running:
+            running.discard(attempt)
+            if error is None:
+                quotes[attempt.stock['ticker']] = (*quote, None)
+            else:
+                failed(attempt, error)
+
+        # Stuck calls carry on in the background but no longer take a worker
+        now = time.monotonic()
+        for stuck in [attempt for attempt in running if attempt.expired(now)]:
+            running.discard(stuck)
+            failed(stuck, f"Timed out after {timeout} s")
+
+    for stock in [attempt.stock for attempt in running] + [stock for stock, _ in waiting]:
+        quotes.setdefault(stock['ticker'], (None, None, f"Timed out: not fetched within {deadline} s"))
+
+    return quotes
+
+# Rates to GBP, fetched once per run and kept by day in data/fx_rates.csv
+fx_rates = FXRates()
+
 # Function to get exchange rate
+# Raises an error when there is no recent rate rather than defaulting to 1.0
+# Prices in pence (GBp) get a rate of 0.01
 def get_exchange_rate(currency):
-    c = CurrencyRates()
-    try:
-        rate = c.get_rate(currency, 'GBP')
-        return rate
-    except Exception as e:
-        print(f"Error fetching exchange rate for {currency}: {e}. Defaulting to 1.0.")
-        return 1.0  # Default to 1 if there's an issue with the API
+    return fx_rates.rate(currency)
 
 # Initialize list for storing results
 results = []
 
-# Fetch stock price and currency, and calculate value in GBP
+# Fetch every stock price and currency concurrently
+quotes = fetch_quotes(data)
+
+# Calculate value in GBP
 for stock in data:
     try:
-        price, currency = get_stock_price(stock['ticker'], stock['name'])
+        price, currency, error = quotes[stock['ticker']]
+        if error is not None:
+            raise ValueError(error)
         exch_rate = get_exchange_rate(currency)
         value_in_gbp = price * exch_rate
         results.append({
@@ -96,6 +187,7 @@ for stock in data:
             "price": price,
             "currency": currency,
             "exchangerate_to_gbp": exch_rate,
+            "exchangerate_date": fx_rates.as_of,
             "value_in_gbp": value_in_gbp
         })
     except Exception as e:
@@ -0,0 +1,128 @@
+# Walk-forward (rolling origin) evaluation of Stocker models
+# The cutoff steps forward through the data; at each cutoff a model is trained
+# on the preceding training_years and scored on the following horizon_days
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import score_prediction
+from parallel import default_workers, pool_map
+from stocker import build_model, predict_model
+
+
+# Fitted Prophet parameters in the form Stan accepts as initial values
+def warm_start_params(model):
+    params = {}
+
+    for name in ['k', 'm', 'sigma_obs']:
+        params[name] = model.params[name][0][0]
+    for name in ['delta', 'beta']:
+        params[name] = model.params[name][0]
+
+    return params
+
+
+# Trading days every step_days from start_date up to end_date
+# Each cutoff is the first trading day on or after the stepped date
+def cutoff_dates(stocker, start_date, end_date, step_days):
+    cutoffs = []
+
+    for date in pd.date_range(start_date, end_date, freq='%dD' % step_days):
+        position, _ = stocker.date_bounds(date)
+        if position < len(stocker.stock):
+            cutoff = stocker.stock.index[position]
+            if cutoff <= end_date and (not cutoffs or cutoff > cutoffs[-1]):
+                cutoffs.append(cutoff)
+
+    return cutoffs
+
+
+# Fit and score a contiguous run of cutoffs in order, starting each fit
+# from the parameters of the previous one. Runs in a worker process.
+def _run_chain(job):
+    params, splits, horizon_days, calendar, warm_start = job
+
+    rows = []
+    init = None
+
+    for cutoff, train, test in splits:
+        start_time = time.time()
+
+        model = build_model(params)
+        if init is not None:
+            model.fit(train, init=init)
+        else:
+            model.fit(train)
+
+        fit_seconds = time.time() - start_time
+
+        future = predict_model(model, horizon_days, calendar)
+
+        train_results = pd.merge(train, future, on='ds', how='inner')
+        test_results = pd.merge(test, future, on='ds', how='inner')
+
+        scores = score_prediction(train_results, test_results, cutoff, test['ds'].max(),
+                                  interval_width=model.interval_width)
+
+        row = {'cutoff': cutoff,
+               'train_start': train['ds'].min(),
+               'test_end': test['ds'].max(),
+               'n_train': len(train),
+               'n_test': len(test_results),
+               'warm_started': init is not None,
+               'fit_seconds': fit_seconds}
+        row.update(scores._asdict())
+        del row['start_date'], row['end_date']
+        rows.append(row)
+
+        if warm_start:
+            init = warm_start_params(model)
+
+    return rows
+
+
+# Walk-forward evaluation of a Stocker's current model parameters
+# Cutoffs run every step_days between start_date and end_date (default: the
+# last two years before the final horizon). The cutoffs are split into
+# contiguous chains, one per worker; within a chain each fit is warm started
+# from the previous cutoff's parameters. Returns one row of metrics per cutoff.
+def walk_forward(stocker, start_date=None, end_date=None, step_days=30, horizon_days=30,
+                 warm_start=True, max_workers=None, **overrides):
+
+    if end_date is None:
+        end_date = stocker.max_date - pd.DateOffset(days=horizon_days)
+    if start_date is None:
+        start_date = end_date - pd.DateOffset(years=2)
+
+    start_date = pd.to_datetime(start_date)
+    end_date = pd.to_datetime(end_date)
+
+    params = stocker.model_params(**overrides)
+
+    # Training and testing windows for each cutoff
+    splits = []
+    for cutoff in cutoff_dates(stocker, start_date, end_date, step_days):
+        train = stocker.prophet_df(cutoff - pd.DateOffset(years=stocker.training_years), cutoff,
+                                   include_start=False, include_end=False)
+        test = stocker.prophet_df(cutoff, cutoff + pd.DateOffset(days=horizon_days))
+
+        if len(train) > 1 and len(test) > 1:
+            splits.append((cutoff, train, test))
+
+    if not splits:
+        return pd.DataFrame()
+
+    if max_workers is None:
+        max_workers = default_workers()
+
+    # Cutoffs in one chain depend on each other, chains are independent
+    chains = np.array_split(np.arange(len(splits)), min(max_workers, len(splits)))
+    jobs = [(params, [splits[i] for i in chain], horizon_days, stocker.calendar, warm_start) for chain in chains]
+
+    rows = [row for chain_rows in pool_map(_run_chain, jobs, max_workers=max_workers) for row in chain_rows]
+
+    results = pd.DataFrame(rows)
+    results.insert(0, 'symbol', stocker.symbol)
+
+    return results
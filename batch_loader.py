@@ -0,0 +1,102 @@
+# Load price histories or Stocker objects for many tickers at once
+# Entry point for universe-wide screening jobs over data/stock_list.csv
+import os
+from collections import Counter
+from functools import partial
+
+from parallel import pool_map
+from price_store import default_store
+from stocker import Stocker, load_stock
+
+# Tickers in the Quandl WIKI database, one per line
+STOCK_LIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'stock_list.csv')
+
+
+# Read the ticker universe, skipping blank lines and duplicates
+def read_stock_list(path=STOCK_LIST_PATH):
+    tickers = []
+    seen = set()
+
+    with open(path) as f:
+        for line in f:
+            ticker = line.strip().upper()
+            if ticker and ticker not in seen:
+                seen.add(ticker)
+                tickers.append(ticker)
+
+    return tickers
+
+
+# Outcome of a batch load: what loaded and why the rest did not
+class BatchResult():
+
+    def __init__(self, loaded, failures):
+
+        # Ticker -> provider frame or Stocker, in request order
+        self.loaded = loaded
+
+        # Ticker -> error message
+        self.failures = failures
+
+    def __len__(self):
+        return len(self.loaded)
+
+    # One line per failure reason, most common first
+    def summary(self):
+        total = len(self.loaded) + len(self.failures)
+        lines = ['Loaded {} of {} tickers, {} failed.'.format(len(self.loaded), total, len(self.failures))]
+
+        reasons = Counter(error.split(':')[0] for error in self.failures.values())
+        for reason, count in reasons.most_common():
+            lines.append('  {}: {}'.format(reason, count))
+
+        return '\n'.join(lines)
+
+
+# Worker job: one ticker through the store (runs in a child process)
+def _load_one(exchange, store, ticker):
+    return load_stock(ticker, exchange, store)
+
+
+# Load the provider frames for tickers with at most max_workers processes
+# Errors are captured per ticker instead of stopping the batch
+def load_frames(tickers, exchange='WIKI', store=None, max_workers=None, chunksize=8):
+    if store is None:
+        store = default_store
+
+    tickers = [ticker.upper() for ticker in tickers]
+
+    results = pool_map(partial(_load_one, exchange, store), tickers,
+                       max_workers=max_workers, capture_errors=True, chunksize=chunksize)
+
+    frames = {}
+    failures = {}
+
+    for ticker, (frame, error) in zip(tickers, results):
+        if error is not None:
+            failures[ticker] = error
+        elif frame is None or len(frame) == 0:
+            failures[ticker] = 'EmptyData: no rows returned'
+        else:
+            frames[ticker] = frame
+
+    return BatchResult(frames, failures)
+
+
+# Build Stocker objects for tickers, loading their frames in parallel
+# columns and dtype are passed to Stocker to keep large universes compact
+def load_stockers(tickers, exchange='WIKI', store=None, max_workers=None, chunksize=8,
+                  columns=None, dtype=None):
+    batch = load_frames(tickers, exchange, store, max_workers, chunksize)
+
+    stockers = {}
+    failures = dict(batch.failures)
+
+    for ticker, frame in batch.loaded.items():
+        try:
+            stockers[ticker] = Stocker(ticker, exchange, stock=frame, verbose=False,
+                                       columns=columns, dtype=dtype)
+        except Exception as e:
+            failures[ticker] = '{}: {}'.format(type(e).__name__, e)
+
+    return BatchResult(stockers, failures)
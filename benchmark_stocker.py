@@ -0,0 +1,199 @@
+# Timings of the main Stocker methods on synthetic price histories
+# Runs offline (no Quandl, no plotting) at several history lengths and
+# writes the timings as JSON, optionally comparing them with an earlier run.
+#
+#   python benchmark_stocker.py --years 1 5 10 30 --engine linear --output bench.json
+#   python benchmark_stocker.py --compare bench.json
+#
+# The time to import stocker in a fresh interpreter is measured too; a data
+# only process must start within --import-budget seconds.
+import io
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import argparse
+import datetime
+import contextlib
+import statistics
+
+import numpy as np
+import pandas as pd
+
+from stocker import Stocker
+from synthetic_prices import synthetic_stock
+
+DEFAULT_YEARS = [1, 5, 10, 30]
+
+# Slower than the baseline by more than this fraction counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Seconds allowed for import stocker in a fresh interpreter
+DEFAULT_IMPORT_BUDGET = 0.75
+
+# Dependencies stocker only imports when a method needs them
+LAZY_DEPENDENCIES = ['quandl', 'fbprophet', 'pytrends', 'matplotlib']
+
+_IMPORT_SCRIPT = '''
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {lazy!r} if name in sys.modules]}}))
+'''
+
+
+# Stocker for a frame, headless and without the model cache so every
+# repeat really fits its models
+def make_stocker(stock, engine):
+    stocker = Stocker('SYNTH', stock=stock, verbose=False)
+    stocker.headless = True
+    stocker.model_cache = None
+    stocker.engine = engine
+    return stocker
+
+
+# Evaluation windows that fit inside the history: a quarter of it, at most a year
+def windows(stocker, years):
+    window = pd.DateOffset(days=int(min(365, 365 * years / 4)))
+    return {'eval_start': stocker.max_date - window,
+            'valid_start': stocker.max_date - window - window,
+            'valid_end': stocker.max_date - window,
+            'df_start': stocker.min_date + (stocker.max_date - stocker.min_date) / 4,
+            'df_end': stocker.max_date - (stocker.max_date - stocker.min_date) / 4}
+
+
+# name -> function(stock, stocker, dates, engine) for each benchmark
+BENCHMARKS = {
+    '__init__': lambda stock, stocker, dates, engine: make_stocker(stock, engine),
+    'make_df': lambda stock, stocker, dates, engine: stocker.make_df(dates['df_start'], dates['df_end']),
+    'buy_and_hold': lambda stock, stocker, dates, engine: stocker.buy_and_hold(dates['df_start'], dates['df_end']),
+    'evaluate_prediction': lambda stock, stocker, dates, engine: stocker.evaluate_prediction(dates['eval_start']),
+    'changepoint_prior_validation': lambda stock, stocker, dates, engine: stocker.changepoint_prior_validation(
+        dates['valid_start'], dates['valid_end'], max_workers=1),
+    'predict_future': lambda stock, stocker, dates, engine: stocker.predict_future(30),
+}
+
+
+# Seconds for each of repeat calls of func
+def time_calls(func, repeat):
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+# Seconds to import module in a fresh interpreter (the fastest of repeat
+# runs) and which of the lazily imported dependencies it loaded anyway
+def import_time(module='stocker', repeat=3):
+    script = _IMPORT_SCRIPT.format(module=module, lazy=LAZY_DEPENDENCIES)
+    runs = []
+
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {'module': module,
+            'seconds': min(run['seconds'] for run in runs),
+            'loaded': runs[0]['loaded']}
+
+
+# Run every benchmark at every history length
+def run(years_list=DEFAULT_YEARS, repeat=3, engine='prophet', names=None, seed=0):
+    names = names or list(BENCHMARKS)
+    results = []
+
+    for years in years_list:
+        stock = synthetic_stock(years, seed=seed)
+        stocker = make_stocker(stock, engine)
+        dates = windows(stocker, years)
+
+        for name in names:
+            benchmark = BENCHMARKS[name]
+            times = time_calls(lambda: benchmark(stock, stocker, dates, engine), repeat)
+
+            results.append({'benchmark': name,
+                            'years': years,
+                            'rows': len(stock),
+                            'repeat': repeat,
+                            'min': min(times),
+                            'median': statistics.median(times),
+                            'mean': statistics.mean(times)})
+
+            print('{:<30} {:>3} years {:>6} rows  median {:>9.4f} s'.format(name, years, len(stock), results[-1]['median']))
+
+    return {'meta': {'engine': engine,
+                     'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'pandas': pd.__version__,
+                     'machine': platform.machine(),
+                     'seed': seed},
+            'results': results}
+
+
+# Benchmarks whose median time grew by more than tolerance against baseline
+def regressions(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    previous = {(row['benchmark'], row['years']): row['median'] for row in baseline['results']}
+    slower = []
+
+    for row in report['results']:
+        key = (row['benchmark'], row['years'])
+        if key in previous and row['median'] > previous[key] * (1 + tolerance):
+            slower.append({'benchmark': row['benchmark'], 'years': row['years'],
+                           'baseline': previous[key], 'median': row['median'],
+                           'ratio': row['median'] / previous[key]})
+
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Stocker on synthetic price histories.')
+    parser.add_argument('--years', nargs='+', type=int, default=DEFAULT_YEARS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engine', choices=['prophet', 'linear'], default='prophet')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help='earlier output to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--import-budget', type=float, default=DEFAULT_IMPORT_BUDGET)
+    args = parser.parse_args()
+
+    report = run(args.years, args.repeat, args.engine, args.benchmarks, args.seed)
+
+    report['import'] = import_time(repeat=args.repeat)
+    report['import']['budget'] = args.import_budget
+    print('{:<30} {:>9.4f} s (budget {:.2f} s)'.format('import stocker', report['import']['seconds'], args.import_budget))
+
+    if args.compare:
+        with open(args.compare) as f:
+            report['regressions'] = regressions(report, json.load(f), args.tolerance)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print('Timings written to %s' % args.output)
+
+    for row in report.get('regressions', []):
+        print('Regression: {} at {} years is {:.2f}x slower'.format(row['benchmark'], row['years'], row['ratio']))
+
+    over_budget = report['import']['seconds'] > args.import_budget or report['import']['loaded']
+    if over_budget:
+        print('Import of stocker took {:.2f} s and loaded {}'.format(report['import']['seconds'],
+                                                                       report['import']['loaded'] or 'no heavy dependencies'))
+
+    if report.get('regressions') or over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# Correlation and covariance of daily returns across many tickers
+# The universe is split into blocks of tickers. For each pair of blocks only
+# those two blocks' returns are in memory, and they are read in chunks of
+# days. Each chunk's moments over the days both tickers traded
+# (pairwise-complete observations) are merged into running totals with Chan's
+# parallel update, which stays accurate over long histories. Rolling output
+# keeps the moments of each period and merges the last window of them.
+#
+#   result = correlation_matrix(batch_loader.read_stock_list(), store_prices('WIKI'))
+#   result.correlation.loc['MSFT', 'AAPL']
+from collections import OrderedDict, deque, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from price_store import default_store
+
+# Correlation and covariance frames and the number of shared days per pair
+CorrelationResult = namedtuple('CorrelationResult', ['correlation', 'covariance', 'counts'])
+
+
+# Price source reading closing prices from a price store
+# Tickers that were never stored give None
+def store_prices(exchange='WIKI', store=None):
+    if store is None:
+        store = default_store
+
+    def prices(ticker):
+        stock = store.read(exchange, ticker, columns=['Adj. Close', 'Close'])
+        if stock is None or stock.empty:
+            return None
+        return stock['Adj. Close'] if 'Adj. Close' in stock.columns else stock['Close']
+
+    return prices
+
+
+# Price source for Stocker objects (a list or a dict of symbol -> Stocker)
+def stocker_prices(stockers):
+    if not isinstance(stockers, dict):
+        stockers = {stocker.symbol: stocker for stocker in stockers}
+
+    return lambda ticker: stockers[ticker].column('Adj. Close') if ticker in stockers else None
+
+
+# Daily log returns of a block of tickers, aligned on the union of their
+# dates with NaN where a ticker has no return
+def block_returns(tickers, prices):
+    columns = {}
+
+    for ticker in tickers:
+        series = prices(ticker)
+        if series is not None:
+            columns[ticker] = np.log(series.astype(float)).diff().iloc[1:]
+
+    returns = pd.DataFrame(columns, columns=tickers)
+    return returns.sort_index()
+
+
+# Running moments of every (x, y) pair of columns from two blocks, over
+# the rows where both are present
+class PairwiseMoments():
+
+    def __init__(self, p, q):
+        self.n = np.zeros((p, q))
+        self.mean_x = np.zeros((p, q))
+        self.mean_y = np.zeros((p, q))
+        self.m2_x = np.zeros((p, q))
+        self.m2_y = np.zeros((p, q))
+        self.c_xy = np.zeros((p, q))
+
+    # Moments of one chunk of rows (X: rows x p, Y: rows x q, NaN missing)
+    @classmethod
+    def from_chunk(cls, X, Y):
+        moments = cls(X.shape[1], Y.shape[1])
+
+        mask_x = ~np.isnan(X)
+        mask_y = ~np.isnan(Y)
+
+        # Shifting by the column means first keeps the sums of squares small
+        shift_x = np.nanmean(np.where(mask_x.any(axis=0), X, 0.0), axis=0)
+        shift_y = np.nanmean(np.where(mask_y.any(axis=0), Y, 0.0), axis=0)
+        X0 = np.where(mask_x, X - shift_x, 0.0)
+        Y0 = np.where(mask_y, Y - shift_y, 0.0)
+        mx = mask_x.astype(float)
+        my = mask_y.astype(float)
+
+        n = mx.T @ my
+        sum_x = X0.T @ my
+        sum_y = mx.T @ Y0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_x = np.where(n > 0, sum_x / n, 0.0)
+            mean_y = np.where(n > 0, sum_y / n, 0.0)
+
+        moments.n = n
+        moments.mean_x = mean_x + shift_x[:, None]
+        moments.mean_y = mean_y + shift_y[None, :]
+        moments.m2_x = np.maximum((X0 ** 2).T @ my - mean_x * sum_x, 0.0)
+        moments.m2_y = np.maximum(mx.T @ (Y0 ** 2) - mean_y * sum_y, 0.0)
+        moments.c_xy = X0.T @ Y0 - mean_x * sum_y
+
+        return moments
+
+    # Add another set of moments (Chan et al. pairwise update)
+    def merge(self, other):
+        n = self.n + other.n
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(n > 0, other.n / n, 0.0)
+
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+        factor = self.n * weight
+
+        self.mean_x = self.mean_x + delta_x * weight
+        self.mean_y = self.mean_y + delta_y * weight
+        self.m2_x = self.m2_x + other.m2_x + delta_x ** 2 * factor
+        self.m2_y = self.m2_y + other.m2_y + delta_y ** 2 * factor
+        self.c_xy = self.c_xy + other.c_xy + delta_x * delta_y * factor
+        self.n = n
+
+        return self
+
+    def copy(self):
+        moments = PairwiseMoments(*self.n.shape)
+        moments.__dict__.update({name: value.copy() for name, value in self.__dict__.items()})
+        return moments
+
+    def covariance(self, min_periods=2):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.n >= max(min_periods, 2), self.c_xy / (self.n - 1), np.nan)
+
+    def correlation(self, min_periods=2):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = self.c_xy / np.sqrt(self.m2_x * self.m2_y)
+        return np.where(self.n >= max(min_periods, 2), np.clip(correlation, -1, 1), np.nan)
+
+
+# Moments of every pair from two aligned blocks, chunk_days rows at a time
+def block_moments(X, Y, chunk_days):
+    moments = PairwiseMoments(X.shape[1], Y.shape[1])
+
+    for start in range(0, len(X), chunk_days):
+        moments.merge(PairwiseMoments.from_chunk(X[start:start + chunk_days], Y[start:start + chunk_days]))
+
+    return moments
+
+
+# Loads blocks of returns, keeping the last max_blocks in memory
+class _BlockReader():
+
+    def __init__(self, tickers, prices, block_size, max_blocks):
+        self.blocks = [tickers[start:start + block_size] for start in range(0, len(tickers), block_size)]
+        self.prices = prices
+        self.max_blocks = max_blocks
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def returns(self, i):
+        if i in self._cache:
+            self._cache.move_to_end(i)
+        else:
+            self._cache[i] = block_returns(self.blocks[i], self.prices)
+            while len(self._cache) > self.max_blocks:
+                self._cache.popitem(last=False)
+        return self._cache[i]
+
+    # Returns of blocks i and j on the union of their dates
+    def pair(self, i, j):
+        x = self.returns(i)
+        y = self.returns(j)
+        dates = x.index.union(y.index)
+        return dates, x.reindex(dates).to_numpy(dtype=float), y.reindex(dates).to_numpy(dtype=float)
+
+
+# Correlation and covariance of the daily log returns of every pair of
+# tickers, each over the days both traded. prices maps a ticker to its
+# closing prices (see store_prices and stocker_prices). Pairs sharing fewer
+# than min_periods days are NaN. Memory use is set by block_size and
+# max_blocks rather than by the number of tickers.
+def correlation_matrix(tickers, prices, block_size=256, chunk_days=252, min_periods=20, max_blocks=4,
+                       dtype='float64'):
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+    reader = _BlockReader(tickers, prices, block_size, max_blocks)
+
+    n = len(tickers)
+    correlation = np.full((n, n), np.nan, dtype=dtype)
+    covariance = np.full((n, n), np.nan, dtype=dtype)
+    counts = np.zeros((n, n), dtype=np.int32)
+
+    for i in range(len(reader)):
+        rows = slice(i * block_size, i * block_size + len(reader.blocks[i]))
+
+        for j in range(i, len(reader)):
+            columns = slice(j * block_size, j * block_size + len(reader.blocks[j]))
+
+            _, X, Y = reader.pair(i, j)
+            moments = block_moments(X, Y, chunk_days)
+
+            correlation[rows, columns] = moments.correlation(min_periods)
+            covariance[rows, columns] = moments.covariance(min_periods)
+            counts[rows, columns] = moments.n
+
+            # The matrices are symmetric
+            correlation[columns, rows] = correlation[rows, columns].T
+            covariance[columns, rows] = covariance[rows, columns].T
+            counts[columns, rows] = counts[rows, columns].T
+
+    return CorrelationResult(pd.DataFrame(correlation, index=tickers, columns=tickers),
+                             pd.DataFrame(covariance, index=tickers, columns=tickers),
+                             pd.DataFrame(counts, index=tickers, columns=tickers))
+
+
+# Correlation over the trailing window periods (freq: 'W', 'M', 'Q', ...)
+# at the end of every period, as date -> ticker-by-ticker frame.
+# Each period's moments are computed once and merged into the windows it
+# belongs to. Intended for holdings-sized sets of tickers: the output has
+# one full matrix per period.
+def rolling_correlation(tickers, prices, window=12, freq='M', block_size=256, min_periods=20, max_blocks=4):
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+    reader = _BlockReader(tickers, prices, block_size, max_blocks)
+
+    n = len(tickers)
+    matrices = {}
+
+    for i in range(len(reader)):
+        rows = slice(i * block_size, i * block_size + len(reader.blocks[i]))
+
+        for j in range(i, len(reader)):
+            columns = slice(j * block_size, j * block_size + len(reader.blocks[j]))
+
+            dates, X, Y = reader.pair(i, j)
+            if len(dates) == 0:
+                continue
+
+            # Positions where each period starts and the last date in it
+            periods = dates.to_period(freq).asi8
+            starts = np.flatnonzero(np.concatenate([[True], np.diff(periods) != 0]))
+            ends = np.append(starts[1:], len(dates))
+
+            recent = deque(maxlen=window)
+            for start, end in zip(starts, ends):
+                recent.append(PairwiseMoments.from_chunk(X[start:end], Y[start:end]))
+
+                moments = recent[0].copy()
+                for later in list(recent)[1:]:
+                    moments.merge(later)
+
+                matrix = matrices.setdefault(dates[end - 1].to_period(freq).end_time.normalize(),
+                                             np.full((n, n), np.nan))
+                matrix[rows, columns] = moments.correlation(min_periods)
+                matrix[columns, rows] = matrix[rows, columns].T
+
+    return OrderedDict((date, pd.DataFrame(matrices[date], index=tickers, columns=tickers))
+                       for date in sorted(matrices))
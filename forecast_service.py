@@ -0,0 +1,289 @@
+# Local HTTP service answering forecast requests as JSON
+# Forecasts are computed ahead of time by a background scheduler and kept in
+# a results store, so a request is a dictionary lookup rather than a model fit.
+#
+#   python forecast_service.py --tickers MSFT AAPL --horizons 30 90 --engine linear
+#
+#   GET /forecast/MSFT?days=30   forecast for the next 30 days
+#   GET /forecasts               tickers and horizons available
+#   GET /health                  scheduler status
+import os
+import json
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+
+from parallel import pool_map
+from stocker import Stocker, load_stock
+
+# Default location of the stored results, next to the price store
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'forecasts')
+
+
+# JSON-ready forecast of a Stocker for the next days
+def forecast_record(stocker, days, engine=None):
+    future = stocker.forecast(days, engine)
+
+    return {'symbol': stocker.symbol,
+            'horizon_days': days,
+            'engine': engine or stocker.engine,
+            'data_end': str(stocker.max_date.date()),
+            'last_price': stocker.most_recent_price,
+            'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'forecast': [{'date': str(row.Date.date()),
+                          'estimate': float(row.estimate),
+                          'lower': float(row.lower),
+                          'upper': float(row.upper),
+                          'change': float(row.change),
+                          'direction': int(row.direction)}
+                         for row in future.itertuples()]}
+
+
+# The record for a shorter horizon, cut from a longer one
+def truncate_record(record, days):
+    last_date = str((pd.Timestamp(record['data_end']) + pd.DateOffset(days=days)).date())
+
+    record = dict(record)
+    record['horizon_days'] = days
+    record['forecast'] = [row for row in record['forecast'] if row['date'] <= last_date]
+
+    return record
+
+
+# Latest forecast for each (symbol, horizon), kept in memory as encoded JSON
+# and optionally in root as one file each so a restart starts warm
+class ResultsStore():
+
+    def __init__(self, root=DEFAULT_RESULTS_DIR):
+        self.root = root
+
+        self._records = {}
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+        # File name -> why it could not be read at startup
+        self.load_errors = {}
+
+        if root is not None:
+            self.load()
+
+    def path(self, symbol, days):
+        return os.path.join(self.root, '%s_%d.json' % (symbol, days))
+
+    # Read every stored result
+    # A file that cannot be read is skipped and recorded in load_errors, and
+    # its forecast is written again on the next refresh
+    def load(self):
+        if not os.path.isdir(self.root):
+            return
+
+        for name in os.listdir(self.root):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.root, name)) as f:
+                        self.put(json.load(f), write=False)
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    self.load_errors[name] = '{}: {}'.format(type(e).__name__, e)
+
+    def put(self, record, write=True):
+        key = (record['symbol'], record['horizon_days'])
+        encoded = json.dumps(record).encode()
+
+        with self._lock:
+            self._records[key] = record
+            self._encoded[key] = encoded
+
+        if write and self.root is not None:
+            os.makedirs(self.root, exist_ok=True)
+            path = self.path(*key)
+
+            with open(path + '.tmp', 'wb') as f:
+                f.write(encoded)
+            os.replace(path + '.tmp', path)
+
+    # Encoded JSON for symbol over days, None if nothing covers it
+    # A stored longer horizon is cut down when the exact one is missing
+    def get(self, symbol, days):
+        symbol = symbol.upper()
+
+        with self._lock:
+            if (symbol, days) in self._encoded:
+                return self._encoded[(symbol, days)]
+
+            longer = [horizon for stored, horizon in self._records if stored == symbol and horizon > days]
+            if not longer:
+                return None
+            record = self._records[(symbol, min(longer))]
+
+        return json.dumps(truncate_record(record, days)).encode()
+
+    # Symbol, horizon and age of every stored result
+    def index(self):
+        with self._lock:
+            return [{'symbol': symbol, 'horizon_days': days,
+                     'data_end': record['data_end'], 'generated_at': record['generated_at']}
+                    for (symbol, days), record in sorted(self._records.items())]
+
+
+# Worker job: every horizon for one ticker (runs in a child process)
+# The horizons share one fitted model through the Stocker's model cache
+def _forecast_ticker(job):
+    ticker, exchange, horizons, engine = job
+
+    # Loaded here rather than by Stocker so a failure is reported
+    stocker = Stocker(ticker, exchange, stock=load_stock(ticker, exchange), verbose=False)
+    stocker.headless = True
+
+    return [forecast_record(stocker, days, engine) for days in horizons]
+
+
+# Background thread that recomputes the forecasts every interval_minutes
+class ForecastScheduler(threading.Thread):
+
+    def __init__(self, results, tickers, horizons=(30,), exchange='WIKI', engine=None,
+                 interval_minutes=60, max_workers=None):
+        super().__init__(daemon=True)
+
+        self.results = results
+        self.tickers = [ticker.upper() for ticker in tickers]
+        self.horizons = sorted(set(horizons))
+        self.exchange = exchange
+        self.engine = engine
+        self.interval_minutes = interval_minutes
+        self.max_workers = max_workers
+
+        self.last_refresh = None
+        self.errors = {}
+
+        self._stop_event = threading.Event()
+
+    # Recompute every ticker once, keeping the old result for any that fail
+    def refresh(self):
+        jobs = [(ticker, self.exchange, self.horizons, self.engine) for ticker in self.tickers]
+        outcomes = pool_map(_forecast_ticker, jobs, max_workers=self.max_workers, capture_errors=True)
+
+        errors = {}
+        for ticker, (records, error) in zip(self.tickers, outcomes):
+            if error is not None:
+                errors[ticker] = error
+                continue
+
+            for record in records:
+                self.results.put(record)
+
+        self.errors = errors
+        self.last_refresh = datetime.datetime.now()
+
+    # A refresh that fails as a whole is reported under 'refresh' in errors
+    # and tried again after the next interval
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.errors = {'refresh': '{}: {}'.format(type(e).__name__, e)}
+
+            self._stop_event.wait(60 * self.interval_minutes)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class ForecastHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['health']:
+            scheduler = self.server.scheduler
+            return self.send_json(200, json.dumps({
+                'results': len(self.server.results.index()),
+                'last_refresh': scheduler.last_refresh.isoformat(timespec='seconds') if scheduler and scheduler.last_refresh else None,
+                'errors': scheduler.errors if scheduler else {},
+                'load_errors': self.server.results.load_errors}).encode())
+
+        if parts == ['forecasts']:
+            return self.send_json(200, json.dumps(self.server.results.index()).encode())
+
+        if len(parts) == 2 and parts[0] == 'forecast':
+            try:
+                days = int(parse_qs(url.query).get('days', ['30'])[0])
+            except ValueError:
+                return self.send_error_json(400, 'days must be a whole number')
+
+            body = self.server.results.get(parts[1], days)
+            if body is None:
+                return self.send_error_json(404, 'No forecast for %s over %d days' % (parts[1].upper(), days))
+
+            return self.send_json(200, body)
+
+        self.send_error_json(404, 'Unknown path %s' % url.path)
+
+    def send_json(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, json.dumps({'error': message}).encode())
+
+    # Requests are not logged to stderr
+    def log_message(self, format, *args):
+        pass
+
+
+class ForecastServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, results, scheduler=None):
+        super().__init__(address, ForecastHandler)
+        self.results = results
+        self.scheduler = scheduler
+
+
+# Start the scheduler and serve until interrupted
+def serve(tickers, horizons=(30,), host='127.0.0.1', port=8000, exchange='WIKI', engine=None,
+          interval_minutes=60, max_workers=None, results_dir=DEFAULT_RESULTS_DIR):
+
+    results = ResultsStore(results_dir)
+    scheduler = ForecastScheduler(results, tickers, horizons, exchange, engine, interval_minutes, max_workers)
+    server = ForecastServer((host, port), results, scheduler)
+
+    scheduler.start()
+    print('Serving forecasts for {} tickers on http://{}:{}'.format(len(scheduler.tickers), host, port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve precomputed Stocker forecasts as JSON.')
+    parser.add_argument('--tickers', nargs='+', required=True)
+    parser.add_argument('--horizons', nargs='+', type=int, default=[30])
+    parser.add_argument('--exchange', default='WIKI')
+    parser.add_argument('--engine', choices=['prophet', 'linear'], default=None)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--refresh-minutes', type=float, default=60)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    serve(args.tickers, args.horizons, args.host, args.port, args.exchange, args.engine,
+          args.refresh_minutes, args.workers)
+
+
+if __name__ == '__main__':
+    main()
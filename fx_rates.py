@@ -0,0 +1,143 @@
+# Exchange rates into GBP for the price scripts
+# Every rate to GBP is fetched in one request the first time a run needs
+# one, then kept in memory and added to a table on disk with one row per day.
+# Later runs that day read the table instead of the network. When no rate
+# can be had the caller gets an error, never a made-up rate of 1.0.
+import os
+import datetime
+
+import pandas as pd
+
+# Table of daily rates: a date column, then one column per currency
+DEFAULT_RATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'fx_rates.csv')
+
+# A stored day is used when today's rates cannot be fetched, if it is at
+# most this many days old
+DEFAULT_MAX_AGE_DAYS = 3
+
+# Currencies quoted in minor units: the major currency and its size
+# (London prices come from Yahoo in pence as GBp, or GBX)
+MINOR_UNITS = {'GBp': ('GBP', 0.01), 'GBX': ('GBP', 0.01), 'GBx': ('GBP', 0.01),
+               'ZAc': ('ZAR', 0.01), 'ILA': ('ILS', 0.01)}
+
+
+# No rate for a currency at all
+class MissingRateError(ValueError):
+    pass
+
+
+# Today's rates could not be fetched and the latest stored ones are too old
+class StaleRateError(MissingRateError):
+    pass
+
+
+# Units of base that one unit of each currency buys, from forex-python
+def fetch_forex_python(base='GBP'):
+    from forex_python.converter import CurrencyRates
+
+    # forex-python gives how many of each currency one base unit buys
+    rates = CurrencyRates().get_rates(base)
+    return {currency: 1 / rate for currency, rate in rates.items() if rate}
+
+
+class FXRates():
+
+    def __init__(self, path=DEFAULT_RATES_PATH, base='GBP', max_age_days=DEFAULT_MAX_AGE_DAYS, fetch=None):
+        self.path = path
+        self.base = base
+        self.max_age_days = max_age_days
+        self.fetch = fetch or fetch_forex_python
+
+        # Date of the rates in use, set on first use
+        self.as_of = None
+
+        self._table = None
+        self._rates = None
+
+        # A failure to get rates is kept too, so a run only tries once
+        self._error = None
+
+    # Stored rates, indexed by date
+    def table(self):
+        if self._table is None:
+            if self.path is not None and os.path.exists(self.path):
+                self._table = pd.read_csv(self.path, index_col='date')
+            else:
+                self._table = pd.DataFrame(index=pd.Index([], name='date'))
+        return self._table
+
+    def _save(self):
+        if self.path is None:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._table.sort_index().to_csv(self.path + '.tmp')
+        os.replace(self.path + '.tmp', self.path)
+
+    # Rates for today: from the table, or fetched once and stored. When
+    # the fetch fails the latest stored day is used if it is recent enough.
+    def rates(self):
+        if self._rates is not None:
+            return self._rates
+        if self._error is not None:
+            raise self._error
+
+        today = datetime.date.today()
+        table = self.table()
+
+        if today.isoformat() in table.index:
+            return self._use(today.isoformat())
+
+        try:
+            fetched = self.fetch(self.base)
+        except Exception as e:
+            try:
+                return self._use_latest(today, '{}: {}'.format(type(e).__name__, e))
+            except StaleRateError as stale:
+                self._error = stale
+                raise
+
+        row = pd.DataFrame([fetched], index=pd.Index([today.isoformat()], name='date'))
+        self._table = pd.concat([table.drop(today.isoformat(), errors='ignore'), row])
+        self._save()
+
+        return self._use(today.isoformat())
+
+    def _use(self, date):
+        self.as_of = date
+        self._rates = self._table.loc[date].dropna().to_dict()
+        self._rates[self.base] = 1.0
+        return self._rates
+
+    def _use_latest(self, today, error):
+        table = self.table()
+        if table.empty:
+            raise StaleRateError('No stored exchange rates and fetching failed ({})'.format(error))
+
+        latest = max(table.index)
+        age = (today - datetime.date.fromisoformat(latest)).days
+        if age > self.max_age_days:
+            raise StaleRateError('Latest stored exchange rates are from {} ({} days old) and fetching failed ({})'.format(
+                latest, age, error))
+
+        print('Fetching exchange rates failed ({}); using rates from {}.'.format(error, latest))
+        return self._use(latest)
+
+    # Units of base that one unit of currency buys
+    def rate(self, currency):
+        currency, scale = MINOR_UNITS.get(currency, (currency, 1.0))
+
+        if currency == self.base:
+            # Load the day's rates anyway so as_of is the same for every row
+            # of a run, but the base needs none of them
+            try:
+                self.rates()
+            except MissingRateError:
+                pass
+            return scale
+
+        rates = self.rates()
+        if currency not in rates:
+            raise MissingRateError('No {} rate for {} on {}'.format(self.base, currency, self.as_of))
+
+        return scale * float(rates[currency])
@@ -0,0 +1,282 @@
+# Search over the Stocker model parameters
+# Candidates are scored by their mean absolute error on validation folds:
+# windows of validation_days just before end_date, the most recent first,
+# each predicted by a model trained on the training_years before it.
+# The budget is the number of model fits, so a search costs the same however
+# large the space is. Successive halving scores every candidate on one fold
+# and only keeps the best 1/eta for the next, larger set of folds.
+#
+#   search = successive_halving(microsoft, budget=60)
+#   apply_params(microsoft, best_params(search))
+import math
+import itertools
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import score_prediction
+from parallel import pool_map
+from stocker import build_model, predict_model
+
+# A value drawn between low and high on a log scale (for random sampling)
+LogUniform = namedtuple('LogUniform', ['low', 'high'])
+
+# Parameter name -> list of values or a LogUniform. The names are those of
+# Stocker.model_params plus training_years.
+DEFAULT_SPACE = {'changepoint_prior_scale': [0.001, 0.01, 0.05, 0.1, 0.2, 0.5],
+                 'training_years': [1, 2, 3, 5],
+                 'monthly_seasonality': [True, False],
+                 'yearly_seasonality': [True, False],
+                 'weekly_seasonality': [False, True]}
+
+
+# Whether every parameter has a list of values, so the space is a grid
+def is_grid(space):
+    return all(not isinstance(values, LogUniform) for values in space.values())
+
+
+def grid_size(space):
+    return math.prod(len(values) for values in space.values())
+
+
+# The grid point at index, in the order of itertools.product, without
+# building the grid
+def grid_point(space, index):
+    point = {}
+
+    for name in reversed(list(space)):
+        index, position = divmod(index, len(space[name]))
+        point[name] = space[name][position]
+
+    return {name: point[name] for name in space}
+
+
+def sample_value(values, rng):
+    if isinstance(values, LogUniform):
+        return float(np.exp(rng.uniform(np.log(values.low), np.log(values.high))))
+    return values[rng.integers(len(values))]
+
+
+# n candidates from the space: distinct grid points when the space is a
+# grid (all of them if it has no more than n), otherwise random draws
+def sample_candidates(space, n, rng):
+    if is_grid(space):
+        size = grid_size(space)
+        if size <= n:
+            return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+        return [grid_point(space, int(index)) for index in sorted(rng.choice(size, n, replace=False))]
+
+    return [{name: sample_value(values, rng) for name, values in space.items()} for _ in range(n)]
+
+
+# Cutoffs of the validation folds, most recent first
+def fold_cutoffs(stocker, n_folds, validation_days, end_date=None):
+    if end_date is None:
+        end_date = stocker.max_date
+
+    end_date = pd.to_datetime(end_date)
+    return [end_date - pd.DateOffset(days=validation_days * (k + 1)) for k in range(n_folds)]
+
+
+# Worker job: fit one candidate on each of its folds and score it on the
+# validation window. Intervals are not needed, so none are sampled.
+def _evaluate_candidate(job):
+    params, splits, validation_days, calendar = job
+    scores = []
+
+    for fold, train, test in splits:
+        model = build_model(params)
+        model.fit(train)
+
+        future = predict_model(model, validation_days, calendar, uncertainty_samples=0)
+
+        train_results = pd.merge(train, future[['ds', 'yhat']], on='ds', how='inner')
+        test_results = pd.merge(test, future[['ds', 'yhat']], on='ds', how='inner')
+
+        metrics = score_prediction(train_results, test_results)
+        scores.append((fold, metrics.train_error, metrics.test_error))
+
+    return scores
+
+
+class _Search():
+
+    def __init__(self, stocker, space, n_folds, validation_days, end_date, max_workers):
+        self.stocker = stocker
+        self.space = space
+        self.validation_days = validation_days
+        self.max_workers = max_workers
+
+        self.cutoffs = fold_cutoffs(stocker, n_folds, validation_days, end_date)
+
+        # (fold, training_years) -> (train, test), sliced once for every candidate
+        self._splits = {}
+
+        # One entry per candidate: parameters, fold scores and any error
+        self.candidates = []
+
+    def split(self, fold, training_years):
+        key = (fold, training_years)
+
+        if key not in self._splits:
+            cutoff = self.cutoffs[fold]
+            train = self.stocker.prophet_df(cutoff - pd.DateOffset(years=training_years), cutoff,
+                                            include_start=False, include_end=False)
+            test = self.stocker.prophet_df(cutoff, cutoff + pd.DateOffset(days=self.validation_days))
+            self._splits[key] = (train, test)
+
+        return self._splits[key]
+
+    def add(self, candidates):
+        start = len(self.candidates)
+        self.candidates.extend({'params': params, 'scores': {}, 'error': None} for params in candidates)
+        return list(range(start, len(self.candidates)))
+
+    # Score the candidates on the folds they have not been scored on yet,
+    # up to the first n_folds, running candidates in parallel
+    def evaluate(self, indices, n_folds):
+        jobs = []
+        for i in indices:
+            candidate = self.candidates[i]
+            overrides = dict(candidate['params'])
+            training_years = overrides.pop('training_years', self.stocker.training_years)
+
+            splits = []
+            for fold in range(n_folds):
+                if fold in candidate['scores']:
+                    continue
+                train, test = self.split(fold, training_years)
+                if len(train) > 1 and len(test) > 1:
+                    splits.append((fold, train, test))
+
+            jobs.append((self.stocker.model_params(**overrides), splits, self.validation_days, self.stocker.calendar))
+
+        outcomes = pool_map(_evaluate_candidate, jobs, max_workers=self.max_workers, capture_errors=True)
+
+        for i, (scores, error) in zip(indices, outcomes):
+            if error is not None:
+                self.candidates[i]['error'] = error
+                continue
+            for fold, train_error, test_error in scores:
+                self.candidates[i]['scores'][fold] = (train_error, test_error)
+
+        return sum(len(job[1]) for job in jobs)
+
+    def test_error(self, i):
+        scores = self.candidates[i]['scores']
+        if self.candidates[i]['error'] is not None or not scores:
+            return np.inf
+        return float(np.mean([test_error for _, test_error in scores.values()]))
+
+    # One row per candidate, best first: candidates scored on more folds
+    # rank above ones dropped earlier, then by mean test error
+    def results(self):
+        rows = []
+
+        for candidate in self.candidates:
+            scores = candidate['scores']
+            row = dict(candidate['params'])
+            row['folds'] = len(scores)
+            row['train_error'] = float(np.mean([train for train, _ in scores.values()])) if scores else np.nan
+            row['test_error'] = float(np.mean([test for _, test in scores.values()])) if scores else np.nan
+            row['error'] = candidate['error']
+            rows.append(row)
+
+        results = pd.DataFrame(rows)
+        if results.empty:
+            return results
+
+        results['_failed'] = results['error'].notna()
+        results = results.sort_values(['_failed', 'folds', 'test_error'], ascending=[True, False, True])
+
+        return results.drop(columns='_failed').reset_index(drop=True)
+
+
+# Score every grid point on every fold. With a budget smaller than the
+# grid, budget // n_folds distinct grid points are picked at random.
+def grid_search(stocker, space=None, budget=None, n_folds=3, validation_days=90, end_date=None,
+                max_workers=None, seed=0):
+    space = DEFAULT_SPACE if space is None else space
+    if not is_grid(space):
+        raise ValueError('A grid search needs a list of values for every parameter')
+
+    n = grid_size(space) if budget is None else max(1, budget // n_folds)
+
+    search = _Search(stocker, space, n_folds, validation_days, end_date, max_workers)
+    indices = search.add(sample_candidates(space, n, np.random.default_rng(seed)))
+    search.evaluate(indices, n_folds)
+
+    return search.results()
+
+
+# Score budget // n_folds random candidates on every fold
+def random_search(stocker, space=None, budget=30, n_folds=3, validation_days=90, end_date=None,
+                  max_workers=None, seed=0):
+    space = DEFAULT_SPACE if space is None else space
+
+    search = _Search(stocker, space, n_folds, validation_days, end_date, max_workers)
+    indices = search.add(sample_candidates(space, max(1, budget // n_folds), np.random.default_rng(seed)))
+    search.evaluate(indices, n_folds)
+
+    return search.results()
+
+
+# Folds scored at each rung: 1, eta, eta^2, ... and finally n_folds
+def rung_folds(n_folds, eta):
+    folds = []
+    f = 1
+    while f < n_folds:
+        folds.append(f)
+        f *= eta
+    folds.append(n_folds)
+    return folds
+
+
+# Model fits successive halving needs when starting from n candidates
+def halving_cost(n, folds, eta):
+    cost = 0
+    previous = 0
+    for rung, f in enumerate(folds):
+        cost += max(1, n // eta ** rung) * (f - previous)
+        previous = f
+    return cost
+
+
+# Successive halving: as many candidates as the budget allows are scored
+# on the most recent fold, the best 1/eta of them on eta folds, and so on
+# until the survivors have been scored on all n_folds
+def successive_halving(stocker, space=None, budget=60, eta=3, n_folds=3, validation_days=90,
+                       end_date=None, max_workers=None, seed=0):
+    space = DEFAULT_SPACE if space is None else space
+    folds = rung_folds(n_folds, eta)
+
+    # Largest starting population whose total cost fits in the budget
+    n = max(1, budget)
+    while n > 1 and halving_cost(n, folds, eta) > budget:
+        n -= 1
+
+    search = _Search(stocker, space, n_folds, validation_days, end_date, max_workers)
+    survivors = search.add(sample_candidates(space, n, np.random.default_rng(seed)))
+
+    for rung, f in enumerate(folds):
+        search.evaluate(survivors, f)
+
+        if rung + 1 < len(folds):
+            keep = max(1, len(survivors) // eta)
+            survivors = sorted(survivors, key=search.test_error)[:keep]
+
+    return search.results()
+
+
+# Parameters of the best candidate in a search's results
+def best_params(results):
+    row = results.iloc[0]
+    return {name: row[name].item() if isinstance(row[name], np.generic) else row[name]
+            for name in results.columns if name not in ('folds', 'train_error', 'test_error', 'error')}
+
+
+# Set a Stocker's model parameters (and training_years) to params
+def apply_params(stocker, params):
+    for name, value in params.items():
+        setattr(stocker, name, value)
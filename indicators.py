@@ -0,0 +1,287 @@
+# Technical indicators on price series
+# The functions work on whole histories (pandas Series in, Series or frames
+# out). Each has a class with the same parameters whose update() takes one
+# new bar in O(1) time and returns the indicator for it, matching what the
+# function gives for the last row, so a live feed can extend an indicator
+# without recomputing the history. Values are NaN until enough bars are seen.
+#
+#   rsi(microsoft.column('Adj. Close'))
+#   live = RSI(14).extend(microsoft.column('Adj. Close'))
+#   live.update(new_close)
+import math
+from collections import deque, namedtuple
+
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+
+MACDValue = namedtuple('MACDValue', ['macd', 'signal', 'histogram'])
+BollingerValue = namedtuple('BollingerValue', ['middle', 'upper', 'lower'])
+
+
+# Simple moving average over window bars
+def sma(series, window=20):
+    return series.rolling(window, min_periods=window).mean()
+
+
+# Exponential moving average with smoothing 2 / (span + 1), started from
+# the first value
+def ema(series, span=20):
+    return series.ewm(span=span, adjust=False, min_periods=span).mean()
+
+
+# Wilder's moving average (smoothing 1 / period), used by RSI and ATR
+def wilder(series, period=14):
+    return series.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+
+
+# Relative strength index (0 to 100) with Wilder smoothing
+def rsi(series, period=14):
+    change = series.diff()
+    gain = wilder(change.clip(lower=0).iloc[1:], period)
+    loss = wilder((-change).clip(lower=0).iloc[1:], period)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = 100 - 100 / (1 + gain / loss)
+
+    # No losses in the window is an RSI of 100
+    values = values.where(loss != 0, 100.0).where(gain.notna())
+    return values.reindex(series.index)
+
+
+# MACD line (fast EMA less slow EMA), its signal line and their difference
+def macd(series, fast=12, slow=26, signal=9):
+    line = series.ewm(span=fast, adjust=False).mean() - series.ewm(span=slow, adjust=False).mean()
+    line = line.where(np.arange(len(series)) >= slow - 1)
+    signal_line = line.ewm(span=signal, adjust=False, min_periods=signal).mean()
+
+    return pd.DataFrame({'macd': line, 'signal': signal_line, 'histogram': line - signal_line})
+
+
+# Bollinger bands: the moving average and num_std population standard
+# deviations either side of it
+def bollinger(series, window=20, num_std=2):
+    middle = sma(series, window)
+    width = num_std * series.rolling(window, min_periods=window).std(ddof=0)
+
+    return pd.DataFrame({'middle': middle, 'upper': middle + width, 'lower': middle - width})
+
+
+# Average true range with Wilder smoothing
+def atr(high, low, close, period=14):
+    previous = close.shift(1)
+    true_range = pd.concat([high - low, (high - previous).abs(), (low - previous).abs()], axis=1).max(axis=1)
+    return wilder(true_range, period)
+
+
+# Annualised standard deviation of daily log returns over window bars
+def rolling_volatility(series, window=20, periods_per_year=TRADING_DAYS):
+    returns = np.log(series).diff()
+    return returns.rolling(window, min_periods=window).std() * math.sqrt(periods_per_year)
+
+
+# Frame of the usual indicators for a Stocker's adjusted prices
+# ATR is left out when the Stocker has no high and low prices
+def stocker_indicators(stocker, window=20, period=14):
+    close = stocker.column('Adj. Close')
+
+    columns = {'SMA %d' % window: sma(close, window),
+               'EMA %d' % window: ema(close, window),
+               'RSI %d' % period: rsi(close, period)}
+
+    columns.update({'MACD' if name == 'macd' else 'MACD ' + name.title(): values
+                    for name, values in macd(close).items()})
+    columns.update({'Bollinger ' + name.title(): values for name, values in bollinger(close, window).items()})
+
+    high, low = [stocker.column_name(name) for name in ('Adj. High', 'Adj. Low')]
+    if high not in stocker.stock.columns:
+        high, low = 'High', 'Low'
+    if high in stocker.stock.columns and low in stocker.stock.columns:
+        columns['ATR %d' % period] = atr(stocker.stock[high], stocker.stock[low], close, period)
+
+    columns['Volatility %d' % window] = rolling_volatility(close, window)
+
+    return pd.DataFrame(columns, index=close.index)
+
+
+class _Indicator():
+
+    # Feed every value of a history through update, returning self
+    def extend(self, values):
+        for value in values:
+            self.update(value)
+        return self
+
+
+class SMA(_Indicator):
+
+    def __init__(self, window=20):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+        self.value = np.nan
+
+    def update(self, value):
+        self.values.append(value)
+        self.total += value
+
+        if len(self.values) > self.window:
+            self.total -= self.values.popleft()
+
+        self.value = self.total / self.window if len(self.values) == self.window else np.nan
+        return self.value
+
+
+# Exponential moving average with smoothing alpha, NaN for the first
+# min_periods - 1 values
+class _Smoothed(_Indicator):
+
+    def __init__(self, alpha, min_periods):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.count = 0
+        self.average = np.nan
+        self.value = np.nan
+
+    def update(self, value):
+        self.count += 1
+        self.average = value if self.count == 1 else self.average + self.alpha * (value - self.average)
+
+        self.value = self.average if self.count >= self.min_periods else np.nan
+        return self.value
+
+
+class EMA(_Smoothed):
+
+    def __init__(self, span=20):
+        super().__init__(2 / (span + 1), span)
+
+
+class Wilder(_Smoothed):
+
+    def __init__(self, period=14):
+        super().__init__(1 / period, period)
+
+
+class RSI(_Indicator):
+
+    def __init__(self, period=14):
+        self.gain = Wilder(period)
+        self.loss = Wilder(period)
+        self.previous = None
+        self.value = np.nan
+
+    def update(self, value):
+        if self.previous is not None:
+            change = value - self.previous
+            gain = self.gain.update(max(change, 0.0))
+            loss = self.loss.update(max(-change, 0.0))
+
+            if not np.isnan(gain):
+                self.value = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+
+        self.previous = value
+        return self.value
+
+
+class MACD(_Indicator):
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = _Smoothed(2 / (fast + 1), 1)
+        self.slow = _Smoothed(2 / (slow + 1), slow)
+        self.signal = EMA(signal)
+        self.value = MACDValue(np.nan, np.nan, np.nan)
+
+    def update(self, value):
+        fast = self.fast.update(value)
+        slow = self.slow.update(value)
+
+        if np.isnan(slow):
+            return self.value
+
+        line = fast - slow
+        signal = self.signal.update(line)
+        self.value = MACDValue(line, signal, line - signal)
+        return self.value
+
+
+# Mean and variance of the last window values, updated as values enter
+# and leave (Welford's method with removal)
+class _WindowMoments():
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        self.values.append(value)
+        delta = value - self.mean
+        self.mean += delta / len(self.values)
+        self.m2 += delta * (value - self.mean)
+
+        if len(self.values) > self.window:
+            old = self.values.popleft()
+            delta = old - self.mean
+            self.mean -= delta / len(self.values)
+            self.m2 -= delta * (old - self.mean)
+
+        return len(self.values) == self.window
+
+    def variance(self, ddof=0):
+        return max(self.m2, 0.0) / (len(self.values) - ddof)
+
+
+class Bollinger(_Indicator):
+
+    def __init__(self, window=20, num_std=2):
+        self.num_std = num_std
+        self.moments = _WindowMoments(window)
+        self.value = BollingerValue(np.nan, np.nan, np.nan)
+
+    def update(self, value):
+        if self.moments.update(value):
+            width = self.num_std * math.sqrt(self.moments.variance())
+            self.value = BollingerValue(self.moments.mean, self.moments.mean + width, self.moments.mean - width)
+        return self.value
+
+
+class ATR(_Indicator):
+
+    def __init__(self, period=14):
+        self.average = Wilder(period)
+        self.previous_close = None
+        self.value = np.nan
+
+    # values are (high, low, close) bars
+    def extend(self, values):
+        for high, low, close in values:
+            self.update(high, low, close)
+        return self
+
+    def update(self, high, low, close):
+        true_range = high - low
+        if self.previous_close is not None:
+            true_range = max(true_range, abs(high - self.previous_close), abs(low - self.previous_close))
+
+        self.previous_close = close
+        self.value = self.average.update(true_range)
+        return self.value
+
+
+class RollingVolatility(_Indicator):
+
+    def __init__(self, window=20, periods_per_year=TRADING_DAYS):
+        self.scale = math.sqrt(periods_per_year)
+        self.moments = _WindowMoments(window)
+        self.previous = None
+        self.value = np.nan
+
+    def update(self, value):
+        if self.previous is not None and self.moments.update(math.log(value / self.previous)):
+            self.value = math.sqrt(self.moments.variance(ddof=1)) * self.scale
+
+        self.previous = value
+        return self.value
@@ -0,0 +1,261 @@
+# Opt-in timing and profiling of Stocker runs
+# Stocker methods and the stages inside them (load, fit, predict, merge, plot)
+# report to the shared recorder below. While it is disabled (the default) a
+# stage costs one attribute check. Once enabled, each stage records wall
+# time, CPU time and (optionally) peak traced memory. Stages are named by
+# their nesting, e.g. 'predict_future.forecast.fit_model.fit'.
+# Work done in pool worker processes is only seen as the parent's stage.
+import io
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+
+
+# Running totals for one stage name
+class StageStats():
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.max_wall_seconds = 0.0
+        self.peak_memory_bytes = 0
+
+    def add(self, wall, cpu, peak):
+        self.calls += 1
+        self.wall_seconds += wall
+        self.cpu_seconds += cpu
+        self.max_wall_seconds = max(self.max_wall_seconds, wall)
+        self.peak_memory_bytes = max(self.peak_memory_bytes, peak)
+
+    def as_dict(self):
+        return {'calls': self.calls,
+                'wall_seconds': self.wall_seconds,
+                'cpu_seconds': self.cpu_seconds,
+                'mean_wall_seconds': self.wall_seconds / self.calls if self.calls else 0.0,
+                'max_wall_seconds': self.max_wall_seconds,
+                'peak_memory_bytes': self.peak_memory_bytes}
+
+
+# One stage in progress
+class _Frame():
+
+    __slots__ = ['name', 'wall', 'cpu', 'memory', 'peak_seen', 'profiler']
+
+    def __init__(self, name):
+        self.name = name
+        self.peak_seen = 0
+        self.profiler = None
+
+
+# Context manager returned while disabled
+class _NullStage():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage():
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.frame = self.recorder.begin(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.end(self.frame)
+        return False
+
+
+class Instrumentation():
+
+    def __init__(self):
+        self.enabled = False
+        self.track_memory = False
+
+        # False, True (every outermost call) or a set of method names
+        self.profile = False
+
+        # Outermost stage name -> list of pstats reports, the last profile_limit kept
+        self.profiles = {}
+        self.profile_limit = 10
+
+        self.stats = {}
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    # Start recording. track_memory uses tracemalloc, which slows Python
+    # code down noticeably; profile runs cProfile around outermost calls
+    def enable(self, track_memory=True, profile=False):
+        self.enabled = True
+        self.track_memory = track_memory
+        self.profile = set(profile) if isinstance(profile, (list, tuple, set)) else profile
+
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.track_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self.profiles = {}
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    # Context manager timing a stage inside the current one
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    # Start a stage; pass the result to end(). For stages that do not fit
+    # in one with block. Returns None while disabled.
+    def begin(self, name):
+        if not self.enabled:
+            return None
+
+        stack = self._stack()
+        frame = _Frame('%s.%s' % (stack[-1].name, name) if stack else name)
+
+        if self._profiling(name) and not stack:
+            frame.profiler = cProfile.Profile()
+            frame.profiler.enable()
+
+        if self.track_memory and tracemalloc.is_tracing():
+            frame.memory, peak = tracemalloc.get_traced_memory()
+            # The enclosing stage keeps the peak reached so far
+            if stack:
+                stack[-1].peak_seen = max(stack[-1].peak_seen, peak)
+            tracemalloc.reset_peak()
+
+        stack.append(frame)
+        frame.cpu = time.process_time()
+        frame.wall = time.perf_counter()
+
+        return frame
+
+    def end(self, frame):
+        if frame is None:
+            return
+
+        wall = time.perf_counter() - frame.wall
+        cpu = time.process_time() - frame.cpu
+
+        # Stages left open by an exception are dropped with this one
+        stack = self._stack()
+        while stack and stack[-1] is not frame:
+            stack.pop()
+        if stack:
+            stack.pop()
+
+        peak = 0
+        if self.track_memory and tracemalloc.is_tracing():
+            peak_here = max(tracemalloc.get_traced_memory()[1], frame.peak_seen)
+            peak = max(peak_here - frame.memory, 0)
+            if stack:
+                stack[-1].peak_seen = max(stack[-1].peak_seen, peak_here)
+
+        if frame.profiler is not None:
+            frame.profiler.disable()
+            self._store_profile(frame)
+
+        with self._lock:
+            self.stats.setdefault(frame.name, StageStats()).add(wall, cpu, peak)
+
+    def _profiling(self, name):
+        if isinstance(self.profile, set):
+            return name in self.profile
+        return bool(self.profile)
+
+    def _store_profile(self, frame):
+        output = io.StringIO()
+        pstats.Stats(frame.profiler, stream=output).sort_stats('cumulative').print_stats(30)
+
+        with self._lock:
+            reports = self.profiles.setdefault(frame.name, [])
+            reports.append(output.getvalue())
+            del reports[:-self.profile_limit]
+
+    # Totals for every stage, by stage name
+    def summary(self):
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in sorted(self.stats.items())}
+
+    def to_json(self, path=None):
+        text = json.dumps(self.summary(), indent=2)
+
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+
+        return text
+
+    # Prometheus text exposition format
+    def to_prometheus(self, prefix='stocker'):
+        summary = self.summary()
+        metrics = [('stage_calls_total', 'counter', 'Calls of each stage', 'calls'),
+                   ('stage_wall_seconds_total', 'counter', 'Wall time spent in each stage', 'wall_seconds'),
+                   ('stage_cpu_seconds_total', 'counter', 'CPU time spent in each stage', 'cpu_seconds'),
+                   ('stage_max_wall_seconds', 'gauge', 'Longest single call of each stage', 'max_wall_seconds'),
+                   ('stage_peak_memory_bytes', 'gauge', 'Largest traced memory growth during a stage', 'peak_memory_bytes')]
+
+        lines = []
+        for metric, kind, description, field in metrics:
+            name = '%s_%s' % (prefix, metric)
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for stage, stats in summary.items():
+                lines.append('%s{stage="%s"} %s' % (name, stage.replace('"', '\\"'), repr(stats[field])))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Recorder shared by every Stocker in the process
+instrumentation = Instrumentation()
+
+
+# Stage timing a pass through the with block
+def stage(name):
+    return instrumentation.stage(name)
+
+
+# Decorator recording every call of a method (or function) as a stage
+def instrumented(func=None, name=None):
+    if func is None:
+        return functools.partial(instrumented, name=name)
+
+    stage_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not instrumentation.enabled:
+            return func(*args, **kwargs)
+
+        frame = instrumentation.begin(stage_name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            instrumentation.end(frame)
+
+    return wrapper
@@ -0,0 +1,29 @@
+# Modules imported on first use
+# quandl, fbprophet, pytrends and matplotlib take seconds to import, so the
+# modules that use them hold a LazyModule instead. Code that only slices data
+# never pays for them, and a missing dependency is reported when it is needed.
+import importlib
+
+
+class LazyModule():
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    # The real module, imported the first time it is asked for
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return '<lazy module %r (%s)>' % (self._name, state)
+
+
+def lazy_import(name):
+    return LazyModule(name)
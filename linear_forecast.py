@@ -0,0 +1,269 @@
+# Closed-form forecasting engine with the same interface Stocker uses from Prophet
+# Piecewise-linear trend plus Fourier seasonality, fit as a regularised least
+# squares problem. The priors mirror Prophet's (Laplace changepoints replaced by
+# a Gaussian with the same scale), so changepoint_prior_scale means the same
+# thing, but a fit is a few matrix products instead of a Stan optimisation.
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+# Seasonalities Stocker can switch on: period in days and default Fourier order
+SEASONALITIES = {'yearly': (365.25, 10),
+                 'monthly': (30.5, 5),
+                 'weekly': (7, 3),
+                 'daily': (1, 4)}
+
+# Prior standard deviations (scaled units) of the trend offset/slope and of
+# the seasonality coefficients, as in Prophet
+TREND_PRIOR_SCALE = 5.0
+SEASONALITY_PRIOR_SCALE = 10.0
+
+# Noise variance used for the first of the two solves
+INITIAL_NOISE_VARIANCE = 1e-3
+
+
+# Fourier features for each (period, order) at the times in days
+def fourier_features(days, seasonalities):
+    columns = []
+
+    for period, order in seasonalities:
+        for n in range(1, order + 1):
+            angle = 2 * np.pi * n * days / period
+            columns.append(np.sin(angle))
+            columns.append(np.cos(angle))
+
+    if not columns:
+        return np.empty((len(days), 0))
+
+    return np.column_stack(columns)
+
+
+# Design matrix: offset, slope, one hinge per changepoint, then seasonality
+def design_matrix(t, changepoints_t, days, seasonalities):
+    trend = np.column_stack([np.ones_like(t), t, np.maximum(t[:, None] - changepoints_t[None, :], 0)])
+    return np.hstack([trend, fourier_features(days, seasonalities)])
+
+
+# Diagonal of the prior precision matrix for the design matrix columns
+def prior_precision(n_changepoints, n_seasonal, changepoint_prior_scale):
+    return np.concatenate([np.full(2, 1 / TREND_PRIOR_SCALE ** 2),
+                           np.full(n_changepoints, 1 / changepoint_prior_scale ** 2),
+                           np.full(n_seasonal, 1 / SEASONALITY_PRIOR_SCALE ** 2)])
+
+
+# Solve (X'X + s_k D) b_k = X'y_k for every column y_k of Y at once
+# One eigendecomposition serves every series and every noise level s_k
+def solve_batch(X, Y, precision, noise_variance):
+    scale = 1 / np.sqrt(precision)
+
+    Xs = X * scale
+    eigenvalues, Q = np.linalg.eigh(Xs.T @ Xs)
+
+    projected = Q.T @ (Xs.T @ Y)
+    coefficients = Q @ (projected / (eigenvalues[:, None] + noise_variance[None, :]))
+
+    return coefficients * scale[:, None]
+
+
+# Forecaster with the parts of the Prophet interface Stocker relies on:
+# fit, make_future_dataframe, predict, changepoints, params and interval_width
+class LinearForecaster():
+
+    def __init__(self, changepoint_prior_scale=0.05, yearly_seasonality=True, monthly_seasonality=True,
+                 weekly_seasonality=False, daily_seasonality=False, changepoints=None,
+                 n_changepoints=25, changepoint_range=0.8, interval_width=0.8, uncertainty_samples=1000):
+
+        self.changepoint_prior_scale = changepoint_prior_scale
+        self.n_changepoints = n_changepoints
+        self.changepoint_range = changepoint_range
+        self.interval_width = interval_width
+        # The interval is worked out in closed form; as with Prophet, 0 leaves it out
+        self.uncertainty_samples = uncertainty_samples
+        self.specified_changepoints = changepoints
+
+        # Periods and Fourier orders of the enabled seasonalities
+        self.seasonalities = {}
+        for name, enabled in [('yearly', yearly_seasonality), ('monthly', monthly_seasonality),
+                              ('weekly', weekly_seasonality), ('daily', daily_seasonality)]:
+            if enabled:
+                period, order = SEASONALITIES[name]
+                # A number instead of True sets the Fourier order, as in Prophet
+                if not isinstance(enabled, bool):
+                    order = int(enabled)
+                self.seasonalities[name] = (period, order)
+
+        self.history = None
+        self.changepoints = None
+        self.params = None
+
+    # Same signature as Prophet.add_seasonality
+    def add_seasonality(self, name, period, fourier_order, **kwargs):
+        self.seasonalities[name] = (period, fourier_order)
+        return self
+
+    # Dates of the changepoints: specified ones, or spread evenly over the
+    # first changepoint_range of the history
+    def _changepoint_dates(self, ds):
+        if self.specified_changepoints is not None:
+            return pd.Series(pd.to_datetime(self.specified_changepoints))
+
+        n_history = int(np.floor(len(ds) * self.changepoint_range))
+        n_changepoints = min(self.n_changepoints, n_history - 1)
+
+        if n_changepoints <= 0:
+            return pd.Series([], dtype='datetime64[ns]')
+
+        positions = np.linspace(0, n_history - 1, n_changepoints + 1).round().astype(int)[1:]
+        return ds.iloc[positions].reset_index(drop=True)
+
+    # Record the time scaling and changepoints for a history
+    def _setup(self, history):
+        self.history = history
+        self.start = history['ds'].min()
+        self.t_scale = max((history['ds'].max() - self.start).days, 1)
+        self.changepoints = self._changepoint_dates(history['ds'])
+        self.changepoints_t = self._scaled_days(self.changepoints) / self.t_scale
+
+    # Same dates as another model's history, so reuse its scaling
+    def _share_setup(self, other, history):
+        self.history = history
+        self.start = other.start
+        self.t_scale = other.t_scale
+        self.changepoints = other.changepoints
+        self.changepoints_t = other.changepoints_t
+
+    # Days since the start of the history
+    def _scaled_days(self, ds):
+        return ((pd.to_datetime(ds) - self.start) / pd.Timedelta(days=1)).to_numpy(dtype=float)
+
+    def _design(self, ds):
+        days = self._scaled_days(ds)
+        return design_matrix(days / self.t_scale, self.changepoints_t, days, list(self.seasonalities.values()))
+
+    def _precision(self):
+        n_seasonal = 2 * sum(order for _, order in self.seasonalities.values())
+        return prior_precision(len(self.changepoints_t), n_seasonal, self.changepoint_prior_scale)
+
+    # Store the coefficients in the same shapes as Prophet's params
+    def _set_coefficients(self, coefficients, noise_variance):
+        n_changepoints = len(self.changepoints_t)
+
+        self.coefficients = coefficients
+        self.noise_variance = noise_variance
+        self.params = {'m': np.array([[coefficients[0]]]),
+                       'k': np.array([[coefficients[1]]]),
+                       'delta': coefficients[2:2 + n_changepoints][None, :],
+                       'beta': coefficients[2 + n_changepoints:][None, :],
+                       'sigma_obs': np.array([[np.sqrt(noise_variance)]])}
+
+    # Fit to a frame with ds and y columns
+    # Extra keyword arguments (such as a Prophet warm start) are ignored
+    def fit(self, df, **kwargs):
+        fit_many([df], model=self)
+        return self
+
+    def make_future_dataframe(self, periods, freq='D', include_history=True):
+        last_date = self.history['ds'].max()
+        dates = pd.date_range(start=last_date, periods=periods + 1, freq=freq)
+        dates = dates[dates > last_date][:periods]
+
+        if include_history:
+            dates = np.concatenate([self.history['ds'].values, dates.values])
+
+        return pd.DataFrame({'ds': pd.to_datetime(dates)})
+
+    # Predictions with an interval that widens past the history the way
+    # Prophet's simulated future changepoints do. As with Prophet, the
+    # interval is left out when uncertainty_samples is 0
+    def predict(self, df):
+        ds = pd.to_datetime(df['ds']).reset_index(drop=True)
+        X = self._design(ds)
+
+        n_trend = 2 + len(self.changepoints_t)
+        trend = X[:, :n_trend] @ self.coefficients[:n_trend]
+        seasonal = X[:, n_trend:] @ self.coefficients[n_trend:]
+
+        yhat = trend + seasonal
+
+        if not self.uncertainty_samples:
+            return pd.DataFrame({'ds': ds,
+                                 'trend': trend * self.y_scale,
+                                 'yhat': yhat * self.y_scale})
+
+        # Future changepoints arrive at the historical rate with the average
+        # historical size, so the trend variance grows with the cube of the horizon
+        t = self._scaled_days(ds) / self.t_scale
+        horizon = np.maximum(t - 1, 0)
+        mean_delta = np.mean(np.abs(self.params['delta'])) if len(self.changepoints_t) else 0.0
+        trend_variance = len(self.changepoints_t) * 2 * mean_delta ** 2 * horizon ** 3 / 3
+
+        z = NormalDist().inv_cdf(0.5 + self.interval_width / 2)
+        width = z * np.sqrt(self.noise_variance + trend_variance)
+
+        return pd.DataFrame({'ds': ds,
+                             'trend': trend * self.y_scale,
+                             'yhat_lower': (yhat - width) * self.y_scale,
+                             'yhat_upper': (yhat + width) * self.y_scale,
+                             'yhat': yhat * self.y_scale})
+
+# ds and y columns without missing values, sorted by date
+# Only copies when the frame needs fixing
+def clean_history(df):
+    history = df[['ds', 'y']]
+
+    if history['y'].isna().any():
+        history = history.dropna()
+    if not pd.api.types.is_datetime64_any_dtype(history['ds']):
+        history = history.assign(ds=pd.to_datetime(history['ds']))
+    if not history['ds'].is_monotonic_increasing:
+        history = history.sort_values('ds')
+
+    return history.reset_index(drop=True)
+
+
+# Fit one model per frame (each with ds and y columns)
+# Frames with identical dates are solved together as one matrix problem,
+# so a universe of tickers over the same window costs little more than one.
+# model is used for a single frame (fit); otherwise models are built from kwargs.
+def fit_many(frames, model=None, **kwargs):
+    models = [model] if model is not None else [LinearForecaster(**kwargs) for _ in frames]
+
+    # Group the frames by their dates
+    groups = {}
+    histories = []
+    for i, df in enumerate(frames):
+        histories.append(clean_history(df))
+        history = histories[-1]
+
+        key = history['ds'].values.tobytes()
+        groups.setdefault(key, []).append(i)
+
+    for members in groups.values():
+        first = models[members[0]]
+        first._setup(histories[members[0]])
+
+        X = first._design(first.history['ds'])
+        precision = first._precision()
+
+        # Scale each series by its largest absolute value, as Prophet does
+        Y = np.column_stack([histories[i]['y'].to_numpy(dtype=float) for i in members])
+        y_scale = np.abs(Y).max(axis=0)
+        y_scale[y_scale == 0] = 1
+        Y = Y / y_scale
+
+        # Solve once with a guessed noise level, then again with each
+        # series' own residual variance
+        noise_variance = np.full(len(members), INITIAL_NOISE_VARIANCE)
+        coefficients = solve_batch(X, Y, precision, noise_variance)
+        noise_variance = np.maximum(np.mean((Y - X @ coefficients) ** 2, axis=0), 1e-12)
+        coefficients = solve_batch(X, Y, precision, noise_variance)
+
+        for column, i in enumerate(members):
+            current = models[i]
+            if current is not first:
+                current._share_setup(first, histories[i])
+            current.y_scale = y_scale[column]
+            current._set_coefficients(coefficients[:, column], noise_variance[column])
+
+    return models
@@ -0,0 +1,126 @@
+# Vectorised scoring of price predictions against actual prices
+# Used by Stocker.evaluate_prediction and Stocker.changepoint_prior_validation
+from collections import namedtuple
+
+import numpy as np
+
+# Scores for one train/test split
+# Errors and uncertainty are in price units, accuracies in percent.
+# interval_width is the nominal coverage of the model interval (0.8 for 80%).
+# The profit fields are None unless a number of shares was played, and NaN
+# when there were no testing days to play them on.
+PredictionMetrics = namedtuple('PredictionMetrics', [
+    'start_date', 'end_date',
+    'train_error', 'test_error',
+    'increase_accuracy', 'decrease_accuracy',
+    'in_range_accuracy', 'interval_width',
+    'train_uncertainty', 'test_uncertainty',
+    'prediction_profit', 'hold_profit'])
+
+
+# Mean of the absolute difference between actual and predicted values
+def mean_absolute_error(y, yhat):
+    y = np.asarray(y, dtype=float)
+    yhat = np.asarray(yhat, dtype=float)
+
+    if len(y) == 0:
+        return np.nan
+
+    return float(np.mean(np.abs(y - yhat)))
+
+
+# Mean width of the prediction interval
+def mean_interval_width(lower, upper):
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+
+    if len(lower) == 0:
+        return np.nan
+
+    return float(np.mean(np.abs(upper - lower)))
+
+
+# Percentage of actual values strictly inside the prediction interval
+def interval_coverage(y, lower, upper):
+    y = np.asarray(y, dtype=float)
+
+    if len(y) == 0:
+        return np.nan
+
+    inside = (y < np.asarray(upper, dtype=float)) & (y > np.asarray(lower, dtype=float))
+    return 100 * float(np.mean(inside))
+
+
+# Percentage of days the price moved the way the model predicted,
+# separately for predicted increases and predicted decreases
+def direction_accuracy(y, yhat):
+    pred_diff = np.diff(np.asarray(yhat, dtype=float))
+    real_diff = np.diff(np.asarray(y, dtype=float))
+
+    correct = np.sign(pred_diff) == np.sign(real_diff)
+
+    increase = pred_diff > 0
+    decrease = pred_diff < 0
+
+    increase_accuracy = 100 * float(np.mean(correct[increase])) if increase.any() else np.nan
+    decrease_accuracy = 100 * float(np.mean(correct[decrease])) if decrease.any() else np.nan
+
+    return increase_accuracy, decrease_accuracy
+
+
+# Cumulative profit from holding nshares on the days the model predicts an
+# increase, and from buying and holding over the same days.
+# Both curves start at 0 on the first day, and are empty with no days.
+def strategy_profit(y, yhat, nshares):
+    y = np.asarray(y, dtype=float)
+
+    if len(y) == 0:
+        return np.zeros(0), np.zeros(0)
+
+    pred_diff = np.diff(np.asarray(yhat, dtype=float))
+    real_diff = np.diff(y)
+
+    # We gain (or lose) the day's change only when we predicted an increase
+    daily_profit = np.where(pred_diff > 0, nshares * real_diff, 0.0)
+
+    prediction_profit = np.concatenate([[0.0], np.cumsum(daily_profit)])
+    hold_profit = nshares * (y - y[0])
+
+    return prediction_profit, hold_profit
+
+
+# Score a prediction from frames holding y, yhat and (optionally)
+# yhat_lower/yhat_upper columns for the training and testing days
+def score_prediction(train, test, start_date=None, end_date=None, nshares=None, interval_width=None):
+
+    increase_accuracy, decrease_accuracy = direction_accuracy(test['y'], test['yhat'])
+
+    # Interval metrics need the uncertainty columns
+    has_interval = 'yhat_lower' in test.columns and 'yhat_upper' in test.columns
+
+    if has_interval:
+        in_range_accuracy = interval_coverage(test['y'], test['yhat_lower'], test['yhat_upper'])
+        train_uncertainty = mean_interval_width(train['yhat_lower'], train['yhat_upper'])
+        test_uncertainty = mean_interval_width(test['yhat_lower'], test['yhat_upper'])
+    else:
+        in_range_accuracy = train_uncertainty = test_uncertainty = None
+
+    prediction_profit = hold_profit = None
+    if nshares:
+        prediction_curve, hold_curve = strategy_profit(test['y'], test['yhat'], nshares)
+        # No testing days means no profit to report either way
+        prediction_profit = float(prediction_curve[-1]) if len(prediction_curve) else np.nan
+        hold_profit = float(hold_curve[-1]) if len(hold_curve) else np.nan
+
+    return PredictionMetrics(
+        start_date=start_date, end_date=end_date,
+        train_error=mean_absolute_error(train['y'], train['yhat']),
+        test_error=mean_absolute_error(test['y'], test['yhat']),
+        increase_accuracy=increase_accuracy,
+        decrease_accuracy=decrease_accuracy,
+        in_range_accuracy=in_range_accuracy,
+        interval_width=interval_width,
+        train_uncertainty=train_uncertainty,
+        test_uncertainty=test_uncertainty,
+        prediction_profit=prediction_profit,
+        hold_profit=hold_profit)
@@ -0,0 +1,122 @@
+# Cache of fitted forecasting models
+# Keyed on ticker, training window, a fingerprint of the training data and
+# the model parameters, so a model is only refit when one of them changes
+import os
+import pickle
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Hash of the training dates and values
+def data_fingerprint(train):
+    digest = hashlib.sha1()
+    digest.update(np.asarray(train['ds'].values, dtype='datetime64[ns]').view('i8').tobytes())
+    digest.update(np.asarray(train['y'].values, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+# Key for a model fit on train with params
+# Extra keyword arguments (for example resample=True) are part of the key
+def cache_key(symbol, train, params, **extra):
+    params = tuple(sorted((name, repr(value)) for name, value in params.items()))
+    extra = tuple(sorted((name, repr(value)) for name, value in extra.items()))
+
+    if len(train) > 0:
+        window = (str(train['ds'].iloc[0]), str(train['ds'].iloc[-1]))
+    else:
+        window = (None, None)
+
+    return (symbol, window, data_fingerprint(train), params, extra)
+
+
+# Least recently used cache of fitted models, optionally backed by
+# pickle files in cache_dir so fits survive between processes
+class ModelCache():
+
+    def __init__(self, max_size=32, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+
+        self._models = OrderedDict()
+
+        # Counters for checking the cache is doing its job
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._models)
+
+    # File holding a model on disk, named <ticker>_<digest>.pkl so a
+    # ticker's models can be removed without reading them
+    def path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, '%s_%s.pkl' % (key[0], digest))
+
+    # Return the model stored under key, or None
+    def get(self, key):
+        if key in self._models:
+            self._models.move_to_end(key)
+            self.hits += 1
+            return self._models[key]
+
+        if self.cache_dir is not None and os.path.exists(self.path(key)):
+            try:
+                with open(self.path(key), 'rb') as f:
+                    model = pickle.load(f)
+
+            # A file written by another library version is just a miss
+            except Exception:
+                model = None
+
+            if model is not None:
+                self._remember(key, model)
+                self.hits += 1
+                return model
+
+        self.misses += 1
+        return None
+
+    # Store a fitted model under key
+    def put(self, key, model):
+        self._remember(key, model)
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self.path(key)
+
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(model, f)
+            os.replace(path + '.tmp', path)
+
+    # Drop every model for symbol, or every model when symbol is None
+    def invalidate(self, symbol=None):
+        for key in list(self._models):
+            if symbol is None or key[0] == symbol:
+                del self._models[key]
+
+        if self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.pkl'):
+                    continue
+
+                # The digest has no underscore, so this is the whole ticker
+                # (BRK_B's files are not BRK's)
+                if symbol is None or name[:-len('.pkl')].rsplit('_', 1)[0] == symbol:
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def clear(self):
+        self.invalidate()
+
+    # Keep the model in memory, evicting the least recently used
+    def _remember(self, key, model):
+        self._models[key] = model
+        self._models.move_to_end(key)
+
+        while len(self._models) > self.max_size:
+            self._models.popitem(last=False)
+
+
+# Cache shared by every Stocker in the process
+default_model_cache = ModelCache()
@@ -0,0 +1,184 @@
+# Monte Carlo simulation of a portfolio's GBP value
+# Daily log returns of the holdings are estimated from their Stocker histories
+# and simulated forward either as correlated normal draws (through the
+# Cholesky factor of their covariance) or by resampling whole historical days,
+# which keeps fat tails and the cross-sectional correlation of each day.
+# Paths are generated in chunks across a process pool: a chunk only holds one
+# day of draws per path at a time. Each chunk sends back the final value of
+# its paths and, for every day, a histogram of the portfolio's log growth on
+# a fixed grid, so the percentile bands come from the summed histograms and
+# no process ever holds every path on every day.
+#
+#   simulation = simulate_portfolio(stockers, {'MSFT': 1200.0, 'AAPL': 800.0}, horizon_days=252)
+#   simulation.bands
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from panel import PricePanel
+from parallel import pool_imap
+from trading_calendar import next_sessions
+
+# Daily log return model for the tickers: mean vector, covariance, its
+# Cholesky factor and the historical days it was estimated from
+ReturnModel = namedtuple('ReturnModel', ['tickers', 'mean', 'covariance', 'cholesky', 'returns'])
+
+# Percentile bands of the portfolio value on each simulated session, the
+# value of every path at the horizon and the starting value
+Simulation = namedtuple('Simulation', ['bands', 'final_values', 'start_value', 'model'])
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Bins of the daily histograms, and their reach either side of the expected
+# log growth in standard deviations of the portfolio's log growth to date.
+# Paths beyond the grid are counted in its end bins, which only moves
+# percentiles further out than the grid reaches.
+BAND_BINS = 1000
+BAND_WIDTH_SIGMAS = 10
+
+
+# Daily log returns of every ticker in a panel over the last lookback_days
+# sessions, keeping only days on which all of them have a return
+def log_returns(panel, lookback_days=None):
+    returns = np.diff(np.log(panel.closes), axis=0)
+    returns = returns[~np.isnan(returns).any(axis=1)]
+
+    if lookback_days is not None:
+        returns = returns[-lookback_days:]
+
+    if len(returns) < 2:
+        raise ValueError('The tickers share fewer than two days of returns')
+
+    return returns
+
+
+# Return model of a panel's tickers
+def estimate_returns(panel, lookback_days=None):
+    returns = log_returns(panel, lookback_days)
+
+    mean = returns.mean(axis=0)
+    covariance = np.atleast_2d(np.cov(returns, rowvar=False))
+
+    # A tiny ridge keeps the factorisation stable for near-duplicate holdings
+    ridge = 1e-12 * max(np.trace(covariance), 1e-12) * np.eye(len(mean))
+    cholesky = np.linalg.cholesky(covariance + ridge)
+
+    return ReturnModel(panel.tickers, mean, covariance, cholesky, returns)
+
+
+# Edges of the histogram grid of log growth on each of horizon_days days,
+# as the lowest edge and the bin width of each day
+def band_grid(model, start_values, horizon_days, bins=BAND_BINS, sigmas=BAND_WIDTH_SIGMAS):
+    weights = start_values / start_values.sum()
+    mean = weights @ model.mean
+    std = np.sqrt(max(weights @ model.covariance @ weights, 0.0))
+
+    days = np.arange(1, horizon_days + 1)
+    half_width = np.maximum(sigmas * std * np.sqrt(days), 1e-6)
+
+    return mean * days - half_width, 2 * half_width / bins
+
+
+# Worker job: value of n_paths paths at the horizon, and a histogram of
+# their log growth on the grid for every day
+def _simulate_chunk(job):
+    model, start_values, horizon_days, n_paths, method, grid, seed = job
+    rng = np.random.default_rng(seed)
+
+    low, width = grid
+    bins = BAND_BINS
+    start_value = start_values.sum()
+
+    log_growth = np.zeros((n_paths, len(start_values)))
+    counts = np.zeros((horizon_days, bins), dtype=np.int32)
+
+    for day in range(horizon_days):
+        if method == 'bootstrap':
+            log_growth += model.returns[rng.integers(len(model.returns), size=n_paths)]
+        else:
+            log_growth += model.mean + rng.standard_normal((n_paths, len(start_values))) @ model.cholesky.T
+
+        values = np.exp(log_growth) @ start_values
+        positions = np.clip(((np.log(values / start_value) - low[day]) // width[day]).astype(int), 0, bins - 1)
+        counts[day] = np.bincount(positions, minlength=bins)
+
+    return values, counts
+
+
+# Percentiles of each day's values from the histograms, interpolating
+# linearly within the bin holding each percentile
+def histogram_percentiles(counts, grid, start_value, percentiles):
+    low, width = grid
+    cumulative = counts.cumsum(axis=1)
+    rows = np.arange(len(counts))
+
+    bands = []
+    for percentile in percentiles:
+        target = cumulative[:, -1] * percentile / 100
+        position = np.minimum((cumulative < target[:, None]).sum(axis=1), counts.shape[1] - 1)
+
+        below = np.where(position > 0, cumulative[rows, np.maximum(position - 1, 0)], 0)
+        inside = counts[rows, position]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(inside > 0, (target - below) / inside, 0.5)
+
+        bands.append(start_value * np.exp(low + (position + fraction) * width))
+
+    return np.column_stack(bands)
+
+
+# Simulate the GBP value of holdings (ticker -> current GBP value) for
+# horizon_days sessions. stockers is a list or dict of Stocker objects (or a
+# PricePanel) covering the holdings. method is 'normal' or 'bootstrap'.
+# Prices move in their own currency at today's exchange rates.
+# The same seed gives the same paths whatever the number of workers.
+def simulate_portfolio(stockers, holdings, horizon_days=252, n_paths=10000, method='normal',
+                       lookback_days=None, percentiles=DEFAULT_PERCENTILES, chunk_size=1000,
+                       calendar='LSE', max_workers=None, seed=0):
+    if method not in ('normal', 'bootstrap'):
+        raise ValueError('Unknown simulation method: %s' % method)
+
+    panel = stockers if isinstance(stockers, PricePanel) else PricePanel.from_stockers(stockers)
+
+    missing = [ticker for ticker in holdings if ticker not in panel.tickers]
+    if missing:
+        raise ValueError('No price history for %s' % ', '.join(missing))
+
+    # Only the held tickers, in the panel's order
+    columns = [i for i, ticker in enumerate(panel.tickers) if ticker in holdings]
+    panel = PricePanel(panel.dates, [panel.tickers[i] for i in columns],
+                       panel.opens[:, columns], panel.closes[:, columns])
+
+    model = estimate_returns(panel, lookback_days)
+    start_values = np.array([holdings[ticker] for ticker in panel.tickers], dtype=float)
+
+    # Independent random streams, one per chunk
+    sizes = [min(chunk_size, n_paths - start) for start in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    grid = band_grid(model, start_values, horizon_days)
+    jobs = [(model, start_values, horizon_days, size, method, grid, chunk_seed)
+            for size, chunk_seed in zip(sizes, seeds)]
+
+    # Histograms are summed as the chunks come back
+    final_values = []
+    counts = np.zeros((horizon_days, BAND_BINS), dtype=np.int64)
+    for values, chunk_counts in pool_imap(_simulate_chunk, jobs, max_workers=max_workers):
+        final_values.append(values)
+        counts += chunk_counts
+
+    dates = next_sessions(calendar, panel.dates[-1], horizon_days)
+    bands = pd.DataFrame(histogram_percentiles(counts, grid, start_values.sum(), percentiles),
+                         index=pd.Index(dates, name='Date'),
+                         columns=['p%g' % percentile for percentile in percentiles])
+
+    return Simulation(bands, np.concatenate(final_values), float(start_values.sum()), model)
+
+
+# Value at risk and expected shortfall of a simulation at the horizon:
+# the loss (in GBP) exceeded in (1 - level) of the paths, and the mean loss
+# over those paths
+def value_at_risk(simulation, level=0.95):
+    losses = simulation.start_value - simulation.final_values
+    var = float(np.percentile(losses, 100 * level))
+    return var, float(losses[losses >= var].mean())
@@ -0,0 +1,220 @@
+# Prices of many tickers aligned on one date axis
+# Opening and closing prices are held as date-by-ticker NumPy matrices, so
+# buy-and-hold profits and returns for a whole basket (and for any number of
+# portfolio weightings) come out of a few array operations.
+import numpy as np
+import pandas as pd
+
+
+# Carry the last valid value forward down each column
+# Values before a column's first valid row stay NaN
+def ffill(matrix):
+    valid = ~np.isnan(matrix)
+    rows = np.where(valid, np.arange(len(matrix))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+
+    filled = matrix[rows, np.arange(matrix.shape[1])]
+    filled[np.cumsum(valid, axis=0) == 0] = np.nan
+
+    return filled
+
+
+# Value of each column at its first valid row, NaN if it has none
+def first_valid(matrix):
+    valid = ~np.isnan(matrix)
+    rows = valid.argmax(axis=0)
+
+    values = matrix[rows, np.arange(matrix.shape[1])]
+    values[~valid.any(axis=0)] = np.nan
+
+    return values
+
+
+class PricePanel():
+
+    # dates: sorted DatetimeIndex, tickers: list of names,
+    # opens and closes: (dates x tickers) float arrays with NaN for no data
+    def __init__(self, dates, tickers, opens, closes):
+        self.dates = pd.DatetimeIndex(dates)
+        self.tickers = list(tickers)
+
+        self.opens = np.asarray(opens, dtype=float)
+        self.closes = np.asarray(closes, dtype=float)
+
+        # Closes carried over days a ticker did not trade, for returns
+        self.filled_closes = ffill(self.closes)
+
+    # Align provider frames (ticker -> frame with a date index) on the union
+    # of their dates. Adjusted prices are used when the frames have them.
+    @classmethod
+    def from_frames(cls, frames, open_column='Adj. Open', close_column='Adj. Close'):
+        tickers = list(frames)
+
+        def column(frame, name):
+            if name not in frame.columns:
+                name = name.replace('Adj. ', '')
+            return frame[name]
+
+        opens = pd.concat([column(frames[ticker], open_column).rename(ticker) for ticker in tickers], axis=1)
+        closes = pd.concat([column(frames[ticker], close_column).rename(ticker) for ticker in tickers], axis=1)
+
+        opens = opens.sort_index()
+        closes = closes.reindex(opens.index)
+
+        return cls(opens.index, tickers, opens.to_numpy(dtype=float), closes.to_numpy(dtype=float))
+
+    # Panel of Stocker objects (or a dict of symbol -> Stocker)
+    @classmethod
+    def from_stockers(cls, stockers):
+        if not isinstance(stockers, dict):
+            stockers = {stocker.symbol: stocker for stocker in stockers}
+
+        frames = {symbol: pd.DataFrame({'Adj. Open': stocker.column('Adj. Open'),
+                                        'Adj. Close': stocker.column('Adj. Close')})
+                  for symbol, stocker in stockers.items()}
+
+        return cls.from_frames(frames)
+
+    def __len__(self):
+        return len(self.tickers)
+
+    # Positions bounding the rows between start_date and end_date inclusive
+    def bounds(self, start_date=None, end_date=None):
+        start = 0 if start_date is None else self.dates.searchsorted(pd.to_datetime(start_date), side='left')
+        end = len(self.dates) if end_date is None else self.dates.searchsorted(pd.to_datetime(end_date), side='right')
+        return start, max(start, end)
+
+    # Price each ticker can be bought at on the first date of a window: its
+    # open that day, or its last close before it if it did not trade that day.
+    # NaN for tickers that only list later, so no later price is used.
+    def _entry_prices(self, start, end):
+        if end <= start:
+            return np.full(len(self.tickers), np.nan)
+
+        prices = self.opens[start].copy()
+        if start > 0:
+            missing = np.isnan(prices)
+            prices[missing] = self.filled_closes[start - 1, missing]
+
+        return prices
+
+    # Normalised weights (one per ticker) for a weighting:
+    # 'equal', 'price' (weighted by price at the first date of the window),
+    # a dict or Series of ticker -> weight, or an array in ticker order.
+    # Tickers with no price on or before the first date get no weight.
+    def weights(self, weighting='equal', start_date=None, end_date=None):
+        start, end = self.bounds(start_date, end_date)
+        start_prices = self._entry_prices(start, end)
+        available = ~np.isnan(start_prices)
+
+        if isinstance(weighting, str):
+            if weighting == 'equal':
+                weights = np.ones(len(self.tickers))
+            elif weighting == 'price':
+                weights = np.nan_to_num(start_prices)
+            else:
+                raise ValueError('Unknown weighting: %s' % weighting)
+        elif isinstance(weighting, (dict, pd.Series)):
+            weights = np.array([weighting.get(ticker, 0.0) for ticker in self.tickers], dtype=float)
+        else:
+            weights = np.asarray(weighting, dtype=float)
+
+        weights = np.where(available, weights, 0.0)
+        total = weights.sum()
+        if total == 0:
+            raise ValueError('No weight on any ticker with prices in the window')
+
+        return weights / total
+
+    # Buy nshares (a number, or one per ticker) of every ticker at the first
+    # open in the window and hold them. Returns the total profit per ticker
+    # and the profit on each day, as Stocker.buy_and_hold does for one.
+    def buy_and_hold(self, start_date=None, end_date=None, nshares=1):
+        start, end = self.bounds(start_date, end_date)
+
+        if isinstance(nshares, (dict, pd.Series)):
+            nshares = [nshares.get(ticker, 0) for ticker in self.tickers]
+        nshares = np.broadcast_to(np.asarray(nshares, dtype=float), (len(self.tickers),))
+
+        start_prices = first_valid(self.opens[start:end])
+        profits = nshares * (self.filled_closes[start:end] - start_prices)
+
+        daily = pd.DataFrame(profits, index=self.dates[start:end], columns=self.tickers)
+        totals = pd.Series(profits[-1] if len(profits) else np.full(len(self.tickers), np.nan),
+                           index=self.tickers, name='hold_profit')
+
+        return totals, daily
+
+    # Growth of one unit of each ticker bought at the first open in the window
+    def _growth(self, start, end):
+        return self.filled_closes[start:end] / first_valid(self.opens[start:end])
+
+    # Return since the first open in the window for each ticker on each day
+    def cumulative_returns(self, start_date=None, end_date=None):
+        start, end = self.bounds(start_date, end_date)
+        return pd.DataFrame(self._growth(start, end) - 1, index=self.dates[start:end], columns=self.tickers)
+
+    # Rows holding the last date of each period ('W', 'M', 'Q', 'A', ...)
+    def _period_ends(self, start, end, freq):
+        periods = self.dates[start:end].to_period(freq).asi8
+        last = np.flatnonzero(np.diff(periods) != 0)
+        return np.append(last, end - start - 1) if end > start else last
+
+    # Return of each ticker over each period in the window. The first period
+    # runs from the first open, later ones from the previous period's close.
+    def periodic_returns(self, freq='M', start_date=None, end_date=None):
+        start, end = self.bounds(start_date, end_date)
+        rows = self._period_ends(start, end, freq)
+
+        growth = self._growth(start, end)[rows]
+        previous = np.vstack([np.ones((1, growth.shape[1])), growth[:-1]])
+
+        return pd.DataFrame(growth / previous - 1, index=self.dates[start:end][rows], columns=self.tickers)
+
+    # Cumulative return of a portfolio for each weighting, one column per
+    # weighting (a dict of name -> weighting, see weights). Without
+    # rebalance the holdings bought on the first day are kept; with a period
+    # such as 'M' the portfolio is set back to its weights at every period end.
+    def portfolio_returns(self, weightings=None, start_date=None, end_date=None, rebalance=None):
+        if weightings is None:
+            weightings = {'equal': 'equal'}
+
+        start, end = self.bounds(start_date, end_date)
+        names = list(weightings)
+
+        # (tickers x weightings)
+        W = np.column_stack([self.weights(weightings[name], start_date, end_date) for name in names])
+
+        # Holdings are bought at the entry prices. Tickers without one have
+        # no weight, so their missing growth must not turn the products into NaN
+        growth = np.nan_to_num(self.filled_closes[start:end] / self._entry_prices(start, end), nan=1.0)
+
+        if rebalance is None:
+            values = growth @ W
+            return pd.DataFrame(values - 1, index=self.dates[start:end], columns=names)
+
+        # Each period the weights are applied to the growth since the last rebalance
+        rows = self._period_ends(start, end, rebalance)
+        period_of_row = np.repeat(np.arange(len(rows)), np.diff(np.concatenate([[0], rows + 1])))
+
+        base = np.vstack([np.ones((1, growth.shape[1])), growth[rows[:-1]]])
+        within = (growth / base[period_of_row]) @ W
+
+        period_values = np.vstack([np.ones((1, len(names))), np.cumprod(within[rows], axis=0)[:-1]])
+        values = within * period_values[period_of_row]
+
+        return pd.DataFrame(values - 1, index=self.dates[start:end], columns=names)
+
+    # One row per ticker: first open and last close in the window, total
+    # return and buy-and-hold profit for nshares
+    def summary(self, start_date=None, end_date=None, nshares=1):
+        start, end = self.bounds(start_date, end_date)
+        totals, _ = self.buy_and_hold(start_date, end_date, nshares)
+
+        start_prices = first_valid(self.opens[start:end])
+        end_prices = self.filled_closes[end - 1] if end > start else np.full(len(self.tickers), np.nan)
+
+        return pd.DataFrame({'start_price': start_prices,
+                             'end_price': end_prices,
+                             'total_return': end_prices / start_prices - 1,
+                             'hold_profit': totals.values}, index=self.tickers)
@@ -0,0 +1,52 @@
+# Helpers for running independent jobs across a pool of workers
+import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# Default pool size, one worker per core
+def default_workers():
+    return os.cpu_count() or 1
+
+
+# Run func and return (result, None), or (None, error message) if it raised
+def call_capturing(func, item):
+    try:
+        return func(item), None
+
+    except Exception as e:
+        return None, '{}: {}'.format(type(e).__name__, e)
+
+
+# Apply func to every item with at most max_workers running at once
+# Results come back in the order of items. With capture_errors each result
+# is a (result, error) pair instead of the first error being raised.
+# func must be a module-level function when use_processes is True
+def pool_map(func, items, max_workers=None, use_processes=True, capture_errors=False, chunksize=1):
+    return list(pool_imap(func, items, max_workers, use_processes, capture_errors, chunksize))
+
+
+# pool_map yielding each result as it comes back, so the caller can fold
+# results together without holding all of them
+def pool_imap(func, items, max_workers=None, use_processes=True, capture_errors=False, chunksize=1):
+    items = list(items)
+
+    if max_workers is None:
+        max_workers = default_workers()
+
+    job = partial(call_capturing, func) if capture_errors else func
+
+    # A single worker runs in this process, which keeps tracebacks simple
+    if max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield job(item)
+        return
+
+    max_workers = min(max_workers, len(items))
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+
+    with executor_class(max_workers=max_workers) as executor:
+        if use_processes:
+            yield from executor.map(job, items, chunksize=chunksize)
+        else:
+            yield from executor.map(job, items)
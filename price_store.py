@@ -0,0 +1,149 @@
+# Local columnar store for daily price histories
+# One file per exchange/ticker (Parquet when pyarrow or fastparquet is
+# installed, pickle otherwise) that Stocker reads before the data provider
+import os
+import datetime
+
+import pandas as pd
+
+# Default location of the store, next to the stock list
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'prices')
+
+
+# Pick the best file format the environment supports
+def default_file_format():
+    for engine in ('pyarrow', 'fastparquet'):
+        try:
+            __import__(engine)
+            return 'parquet'
+        except ImportError:
+            continue
+    return 'pickle'
+
+
+# Stores the provider frames (Date index plus price columns) on disk
+# and appends only the trailing dates that are missing
+class PriceStore():
+
+    def __init__(self, root=DEFAULT_STORE_DIR, max_age_days=1, file_format=None):
+
+        # Directory holding one sub-directory per exchange
+        self.root = root
+
+        # Files written more recently than this are used without
+        # asking the provider for new dates
+        self.max_age_days = max_age_days
+
+        self.file_format = file_format or default_file_format()
+
+    # Location of the file for an exchange/ticker pair
+    def path(self, exchange, ticker):
+        extension = 'parquet' if self.file_format == 'parquet' else 'pkl'
+        return os.path.join(self.root, exchange.upper(), '%s.%s' % (ticker.upper(), extension))
+
+    # Read the stored history, None if the ticker has never been stored
+    # columns limits the columns returned; names not stored are skipped.
+    # Parquet files only read those columns from disk.
+    def read(self, exchange, ticker, columns=None):
+        path = self.path(exchange, ticker)
+
+        if not os.path.exists(path):
+            return None
+
+        if self.file_format == 'parquet':
+            if columns is not None:
+                try:
+                    return pd.read_parquet(path, columns=list(columns))
+                # Some of the columns are not in the file
+                except Exception:
+                    pass
+            stock = pd.read_parquet(path)
+        else:
+            stock = pd.read_pickle(path)
+
+        return _select(stock, columns)
+
+    # Write the full history, replacing any previous file atomically
+    def write(self, exchange, ticker, stock):
+        path = self.path(exchange, ticker)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = path + '.tmp'
+        if self.file_format == 'parquet':
+            stock.to_parquet(tmp_path)
+        else:
+            stock.to_pickle(tmp_path)
+
+        os.replace(tmp_path, path)
+
+    # Remove the stored history for a ticker
+    def delete(self, exchange, ticker):
+        path = self.path(exchange, ticker)
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Stored data is fresh if the file was written recently or
+    # already covers the last weekday before today
+    def is_fresh(self, exchange, ticker, stock):
+        path = self.path(exchange, ticker)
+        age = datetime.datetime.now() - datetime.datetime.fromtimestamp(os.path.getmtime(path))
+
+        if age < datetime.timedelta(days=self.max_age_days):
+            return True
+
+        last_weekday = pd.Timestamp.today().normalize() - pd.offsets.BDay(1)
+        return stock.index.max() >= last_weekday
+
+    # Return the history for a ticker, calling fetch(start_date) only for
+    # what is missing. fetch(None) must return the full history.
+    # columns limits the columns returned (the file always keeps them all)
+    def load(self, exchange, ticker, fetch, columns=None):
+
+        stock = self.read(exchange, ticker, columns)
+
+        # Nothing stored yet, pull the full history once
+        if stock is None:
+            stock = fetch(None).sort_index()
+            self.write(exchange, ticker, stock)
+            return _select(stock, columns)
+
+        if self.is_fresh(exchange, ticker, stock):
+            return stock
+
+        # Appending needs every column
+        if columns is not None:
+            stock = self.read(exchange, ticker)
+
+        # Only request the dates after the last stored one
+        start_date = stock.index.max() + pd.DateOffset(days=1)
+
+        try:
+            new_rows = fetch(start_date)
+
+        # Offline or provider failure, the stored history is still usable
+        except Exception as e:
+            print('Could not update {}/{}, using stored data.'.format(exchange, ticker))
+            print(e)
+            return _select(stock, columns)
+
+        new_rows = new_rows[new_rows.index > stock.index.max()]
+
+        if len(new_rows) > 0:
+            stock = pd.concat([stock, new_rows.reindex(columns=stock.columns)]).sort_index()
+            self.write(exchange, ticker, stock)
+        else:
+            # Record the check so the provider is not asked again until stale
+            os.utime(self.path(exchange, ticker), None)
+
+        return _select(stock, columns)
+
+
+# The given columns of a frame, skipping any it does not have
+def _select(stock, columns):
+    if columns is None:
+        return stock
+    return stock[[column for column in stock.columns if column in set(columns)]]
+
+
+# Store shared by every Stocker in the process
+default_store = PriceStore()
@@ -0,0 +1,91 @@
+# Render Stocker charts to image files without an interactive session
+# Each worker process draws with matplotlib's Agg backend (the caller's
+# backend is restored when the charts are drawn in its own process), and the
+# plot styles are set up once per process by Stocker.reset_plot
+import io
+import os
+import contextlib
+
+import matplotlib.pyplot as plt
+
+from batch_loader import BatchResult
+from parallel import pool_map
+
+
+# Switch this process to the non-interactive Agg backend
+# Returns the backend it was using before
+def use_agg():
+    previous = plt.get_backend()
+
+    if previous.lower() != 'agg':
+        plt.switch_backend('Agg')
+
+    return previous
+
+
+# Worker job: every chart for one Stocker, so its data is sent to a worker
+# once and its fitted models are shared between the charts.
+# Returns one (result, files, error) triple per chart.
+def _render_stocker(job):
+    stocker, charts, plot_dir, quiet, caller = job
+
+    backend = use_agg()
+
+    # A single worker runs in the caller's process, so put the settings
+    # (and the backend) back
+    settings = stocker.headless, stocker.plot_dir, stocker.rendered_files
+    stocker.headless = True
+    stocker.plot_dir = plot_dir
+
+    outputs = []
+
+    for method, kwargs in charts:
+        stocker.rendered_files = []
+
+        try:
+            # The methods print their findings, which nobody reads in a batch
+            output = contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext()
+            with output:
+                result = getattr(stocker, method)(**kwargs)
+            outputs.append((result, stocker.rendered_files, None))
+
+        except Exception as e:
+            plt.close('all')
+            outputs.append((None, stocker.rendered_files, '{}: {}'.format(type(e).__name__, e)))
+
+    stocker.headless, stocker.plot_dir, stocker.rendered_files = settings
+
+    if os.getpid() == caller and backend.lower() != 'agg':
+        plt.switch_backend(backend)
+
+    return outputs
+
+
+# Render charts for many Stockers with at most max_workers processes
+# charts is a list of (method name, keyword arguments), for example
+# [('plot_stock', {}), ('predict_future', {'days': 30})].
+# Figures are saved as plot_dir/<symbol>_<chart>.png; with plot_dir None
+# only the data is computed. Returns a BatchResult keyed on (symbol, method)
+# whose loaded values are (returned data, list of files written).
+def render_charts(stockers, charts, plot_dir=None, max_workers=None, quiet=True):
+    stockers = list(stockers)
+    charts = [(method, dict(kwargs or {})) for method, kwargs in charts]
+
+    jobs = [(stocker, charts, plot_dir, quiet, os.getpid()) for stocker in stockers]
+    results = pool_map(_render_stocker, jobs, max_workers=max_workers, capture_errors=True)
+
+    rendered = {}
+    failures = {}
+
+    for stocker, (outputs, error) in zip(stockers, results):
+        if error is not None:
+            outputs = [(None, [], error)] * len(charts)
+
+        for (method, _), (result, files, chart_error) in zip(charts, outputs):
+            key = (stocker.symbol, method)
+            if chart_error is not None:
+                failures[key] = chart_error
+            else:
+                rendered[key] = (result, files)
+
+    return BatchResult(rendered, failures)
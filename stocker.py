@@ -1,76 +1,227 @@
 # Quandl for financial analysis, pandas and numpy for data manipulation
-# fbprophet for additive models, #pytrends for Google trend data
-import quandl
+# fbprophet for additive models
+# Quandl, fbprophet and matplotlib are slow to import, so they are only
+# imported by the first method that uses them
 import pandas as pd
 import numpy as np
-import fbprophet
-import pytrends
-from pytrends.request import TrendReq
+
+from lazy_modules import lazy_import
+
+quandl = lazy_import('quandl')
+fbprophet = lazy_import('fbprophet')
 
 # matplotlib pyplot for plotting
-import matplotlib.pyplot as plt
+plt = lazy_import('matplotlib.pyplot')
+
+matplotlib = lazy_import('matplotlib')
+
+import os
+
+# Local price history store read before Quandl
+from price_store import default_store
+
+# Vectorised prediction scoring
+from metrics import score_prediction, strategy_profit
+
+# Process pool for model grids
+from parallel import pool_map
+
+# Fitted models reused across calls
+from model_cache import cache_key, default_model_cache
+
+# Closed-form alternative to Prophet
+from linear_forecast import LinearForecaster
+
+# Exchange trading sessions
+from trading_calendar import calendar_for_exchange, filter_sessions, future_frame, sessions
+
+# Cached, rate-limited Google Trends
+import trends as google_trends
+
+# Opt-in timing of methods and their stages
+from instrumentation import instrumentation, instrumented, stage
+
+# rc parameters that belong to the session rather than a plot style
+# They are left alone when a cached style is applied
+SESSION_PARAMS = ('backend', 'interactive', 'toolbar', 'timezone', 'webagg',
+                  'savefig.directory', 'figure.max_open_warning')
+
+# rc parameters for each plot style, filled in by Stocker.reset_plot
+_plot_params = {}
+
+# Download the history for a ticker from Quandl, starting at start_date if given
+def fetch_quandl(exchange, ticker, start_date=None):
+    if start_date is None:
+        return quandl.get('%s/%s' % (exchange, ticker))
+
+    return quandl.get('%s/%s' % (exchange, ticker), start_date=start_date)
+
+# Load the provider frame for a ticker through a price store
+# Raises on failure so callers can decide how to report it
+# columns limits the columns read (the open and close prices are always read)
+def load_stock(ticker, exchange='WIKI', store=None, columns=None):
+    if store is None:
+        store = default_store
 
-import matplotlib
+    ticker = ticker.upper()
+
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + REQUIRED_COLUMNS))
+
+    return store.load(exchange, ticker,
+                      lambda start_date: fetch_quandl(exchange, ticker, start_date),
+                      columns=columns)
+
+# Columns every Stocker keeps: the adjusted prices, or the raw ones
+# for providers without adjusted prices
+REQUIRED_COLUMNS = ['Adj. Open', 'Adj. Close', 'Open', 'Close']
+
+# Compact copy of a provider frame: sorted Date index and only the wanted
+# columns (always including the open and close prices), with the price
+# columns converted to dtype (e.g. 'float32') if given. Volumes keep their type.
+def compact_frame(stock, columns=None, dtype=None):
+    stock = stock.sort_index()
+    
+    if columns is not None:
+        wanted = set(columns) | set(REQUIRED_COLUMNS)
+        stock = stock[[column for column in stock.columns if column in wanted]]
+    
+    if dtype is not None:
+        prices = [column for column in stock.columns
+                  if 'Volume' not in column and pd.api.types.is_float_dtype(stock[column])]
+        stock = stock.astype({column: dtype for column in prices})
+    
+    stock.index = pd.DatetimeIndex(stock.index, name='Date')
+    
+    return stock
+
+# Make an untrained model from a dict of Stocker model parameters
+# engine 'prophet' (default) uses fbprophet, 'linear' the closed-form LinearForecaster
+def build_model(params):
+
+    if params.get('engine', 'prophet') == 'linear':
+        return LinearForecaster(daily_seasonality=params['daily_seasonality'],
+                                weekly_seasonality=params['weekly_seasonality'],
+                                yearly_seasonality=params['yearly_seasonality'],
+                                monthly_seasonality=params['monthly_seasonality'],
+                                changepoint_prior_scale=params['changepoint_prior_scale'],
+                                changepoints=params['changepoints'])
+
+    # Make the model
+    model = fbprophet.Prophet(daily_seasonality=params['daily_seasonality'],  
+                              weekly_seasonality=params['weekly_seasonality'], 
+                              yearly_seasonality=params['yearly_seasonality'],
+                              changepoint_prior_scale=params['changepoint_prior_scale'],
+                              changepoints=params['changepoints'])
+    
+    if params['monthly_seasonality']:
+        # Add monthly seasonality
+        model.add_seasonality(name = 'monthly', period = 30.5, fourier_order = 5)
+    
+    return model
+
+# Predict a fitted model periods days past the training data
+# With a trading calendar only its sessions are predicted
+# uncertainty_samples overrides the model's for this prediction only (so a
+# cached model is left as it was); 0 leaves out yhat_lower and yhat_upper
+def predict_model(model, periods, calendar=None, uncertainty_samples=None):
+    if calendar is None:
+        future = model.make_future_dataframe(periods=periods, freq='D')
+    else:
+        future = future_frame(model.history['ds'], periods, calendar)
+    
+    if uncertainty_samples is None:
+        return model.predict(future)
+    
+    default_samples = model.uncertainty_samples
+    model.uncertainty_samples = uncertainty_samples
+    try:
+        return model.predict(future)
+    finally:
+        model.uncertainty_samples = default_samples
+
+# Fit a model on train and predict it periods days past the training data
+# Takes one (params, train, periods, calendar, uncertainty_samples) tuple so
+# it can run in a worker process
+def fit_and_predict(job):
+    params, train, periods, calendar, uncertainty_samples = job
+    
+    model = build_model(params)
+    model.fit(train)
+    
+    return model, predict_model(model, periods, calendar, uncertainty_samples)
 
 # Class for analyzing and (attempting) to predict future prices
 # Contains a number of visualizations and analysis methods
 class Stocker():
     
     # Initialization requires a ticker symbol
-    def __init__(self, ticker, exchange='WIKI'):
+    # Prices are read from the local store and only the missing
+    # trailing dates are requested from Quandl
+    # A provider frame already in memory can be passed as stock
+    # columns limits the provider columns kept in memory (the open and close
+    # prices are always kept) and dtype='float32' halves the price columns
+    @instrumented
+    def __init__(self, ticker, exchange='WIKI', store=None, stock=None, verbose=True,
+                 columns=None, dtype=None):
         
         # Enforce capitalization
         ticker = ticker.upper()
         
         # Symbol is used for labeling plots
         self.symbol = ticker
+        self.exchange = exchange
+        
+        # Trading calendar used for future dates and removing non-trading days
+        self.calendar = calendar_for_exchange(exchange)
         
         # Use Personal Api Key
         # quandl.ApiConfig.api_key = 'YourKeyHere'
 
         # Retrieval the financial data
-        try:
-            stock = quandl.get('%s/%s' % (exchange, ticker))
-        
-        except Exception as e:
-            print('Error Retrieving Data.')
-            print(e)
-            return
+        if stock is None:
+            try:
+                with stage('load'):
+                    stock = load_stock(ticker, exchange, store, columns)
+            
+            except Exception as e:
+                print('Error Retrieving Data.')
+                print(e)
+                return
         
-        # Set the index to a column called Date
-        stock = stock.reset_index(level=0)
+        # Provider columns only, on a sorted Date index so date ranges are
+        # found by binary search. Date, ds, y and Daily Change are not stored:
+        # column() and prophet_df() derive them when a method needs them.
+        stock = compact_frame(stock, columns, dtype)
         
-        # Columns required for prophet
-        stock['ds'] = stock['Date']
-
+        # Columns standing in for others: y is the adjusted close, and
+        # providers without adjusted prices use the raw ones
+        self.aliases = {'y': 'Adj. Close'}
         if ('Adj. Close' not in stock.columns):
-            stock['Adj. Close'] = stock['Close']
-            stock['Adj. Open'] = stock['Open']
-        
-        stock['y'] = stock['Adj. Close']
-        stock['Daily Change'] = stock['Adj. Close'] - stock['Adj. Open']
+            self.aliases.update({'Adj. Close': 'Close', 'Adj. Open': 'Open'})
         
         # Data assigned as class attribute
-        self.stock = stock.copy()
+        self.stock = stock
         
         # Minimum and maximum date in range
-        self.min_date = min(stock['Date'])
-        self.max_date = max(stock['Date'])
+        self.min_date = stock.index[0]
+        self.max_date = stock.index[-1]
         
         # Find max and min prices and dates on which they occurred
-        self.max_price = np.max(self.stock['y'])
-        self.min_price = np.min(self.stock['y'])
-        
-        self.min_price_date = self.stock[self.stock['y'] == self.min_price]['Date']
-        self.min_price_date = self.min_price_date[self.min_price_date.index[0]]
-        self.max_price_date = self.stock[self.stock['y'] == self.max_price]['Date']
-        self.max_price_date = self.max_price_date[self.max_price_date.index[0]]
+        self.refresh_extremes()
         
         # The starting price (starting with the opening price)
-        self.starting_price = float(self.stock.loc[0, 'Adj. Open'])
+        self.starting_price = float(self.column('Adj. Open').iloc[0])
         
         # The most recent price
-        self.most_recent_price = float(self.stock.loc[self.stock.index[-1], 'y'])
+        self.most_recent_price = float(self.column('y').iloc[-1])
+
+        # Fitted models are reused while the data and parameters are unchanged
+        # Set to None to always refit
+        self.model_cache = default_model_cache
+        
+        # Whether models for this data may be in the cache (checked by update)
+        self._models_cached = True
 
         # Whether or not to round dates
         self.round_dates = True
@@ -87,9 +238,30 @@ class Stocker():
         self.yearly_seasonality = True
         self.changepoints = None
         
-        print('{} Stocker Initialized. Data covers {} to {}.'.format(self.symbol,
-                                                                     self.min_date,
-                                                                     self.max_date))
+        # Forecasting engine: 'prophet' or the much faster 'linear'
+        self.engine = 'prophet'
+        
+        # Uncertainty samples drawn when evaluate_prediction and
+        # changepoint_prior_validation predict. None keeps the model's full
+        # intervals; 0 skips them (a much faster predict), and the interval
+        # metrics are then reported as None
+        self.evaluation_samples = None
+        
+        # Headless Stockers never open windows: figures are saved to plot_dir
+        # (when set) and the methods just return their data
+        self.headless = False
+        self.plot_dir = None
+        self.rendered_files = []
+        
+        # Google Trends requests go through a shared cache and rate limiter
+        # None uses trends.default_trends_client, looked up when needed so
+        # the Stocker does not hold its lock and can be pickled
+        self._trends_client = None
+        
+        if verbose:
+            print('{} Stocker Initialized. Data covers {} to {}.'.format(self.symbol,
+                                                                         self.min_date,
+                                                                         self.max_date))
     
     """
     Make sure start and end dates are in the range and can be
@@ -143,86 +315,285 @@ class Stocker():
         
         return start_date, end_date
         
+    # A column of the data by name, following the aliases
+    # Daily Change (close minus open) is worked out on the fly
+    def column(self, name, df=None):
+        
+        if df is None:
+            df = self.stock
+        
+        if name == 'Daily Change' and name not in df.columns:
+            return self.column('Adj. Close', df) - self.column('Adj. Open', df)
+        
+        return df[self.column_name(name, df)]
+    
+    # Name of the stored column a name refers to
+    def column_name(self, name, df=None):
+        
+        if df is None:
+            df = self._stock
+        
+        while name not in df.columns and name in self.aliases:
+            name = self.aliases[name]
+        
+        return name
+    
+    # Frame with the ds and y columns Prophet needs for the rows between
+    # start_date and end_date, plus any other columns asked for
+    # Only built for the rows in the range
+    def prophet_df(self, start_date=None, end_date=None, include_start=True, include_end=True, columns=()):
+        
+        rows = self.slice_dates(start_date, end_date, include_start, include_end)
+        
+        frame = {'ds': rows.index.values, 'y': self.column('y', rows).to_numpy(dtype=float)}
+        for name in columns:
+            frame[name] = self.column(name, rows).values
+        
+        return pd.DataFrame(frame)
+    
+    # Client for Google Trends requests
+    @property
+    def trends_client(self):
+        
+        if self._trends_client is None:
+            return google_trends.default_trends_client
+        return self._trends_client
+    
+    @trends_client.setter
+    def trends_client(self, client):
+        
+        self._trends_client = client
+    
+    # The model cache is shared by the whole process, so it is left out when
+    # a Stocker is pickled (for example to send it to a worker). The copy uses
+    # its own process's default cache, or none if caching was turned off.
+    def __getstate__(self):
+        
+        state = self.__dict__.copy()
+        state['model_cache'] = None
+        state['_model_cache_enabled'] = self.model_cache is not None
+        return state
+    
+    def __setstate__(self, state):
+        
+        state = dict(state)
+        enabled = state.pop('_model_cache_enabled', True)
+        self.__dict__.update(state)
+        self.model_cache = default_model_cache if enabled else None
+    
+    # Bytes held by the price data
+    def memory_usage(self):
+        
+        return int(self.stock.memory_usage(index=True, deep=True).sum())
+    
+    # Price data, with any bars added by update() merged in first
+    @property
+    def stock(self):
+        
+        if self._pending:
+            self.consolidate()
+        
+        return self._stock
+    
+    @stock.setter
+    def stock(self, stock):
+        
+        self._stock = stock
+        self._pending = {}
+    
+    # Highest and lowest closing prices and their dates, from all the data
+    def refresh_extremes(self):
+        
+        close = self.column('y')
+        
+        self.max_price = float(close.max())
+        self.min_price = float(close.min())
+        
+        self.min_price_date = close.idxmin()
+        self.max_price_date = close.idxmax()
+    
+    # Write the bars held by update() into the price data in one go
+    def consolidate(self):
+        
+        pending, self._pending = self._pending, {}
+        stock = self._stock
+        
+        last_date = stock.index[-1]
+        new_dates = [date for date in pending if date > last_date]
+        
+        # Changes to bars already in the data
+        for date in pending:
+            if date <= last_date:
+                for name, value in pending[date].items():
+                    stock.loc[date, name] = value
+        
+        if new_dates:
+            new_rows = pd.DataFrame([pending[date] for date in new_dates],
+                                    index=pd.DatetimeIndex(new_dates, name=stock.index.name),
+                                    columns=stock.columns)
+            self._stock = pd.concat([stock, new_rows.astype(stock.dtypes.to_dict())])
+    
+    # Bookkeeping after the data changed: the summary statistics for a new
+    # close on date, and dropping the now stale cached models
+    def _record_close(self, date, close):
+        
+        if date >= self.max_date:
+            self.max_date = date
+            self.most_recent_price = close
+        
+        # A new extreme, or the bar holding an extreme moved back inside
+        # the range (then the data has to be searched again)
+        if date == self.max_price_date and close < self.max_price:
+            self.refresh_extremes()
+        elif date == self.min_price_date and close > self.min_price:
+            self.refresh_extremes()
+        else:
+            if close > self.max_price:
+                self.max_price, self.max_price_date = close, date
+            if close < self.min_price:
+                self.min_price, self.min_price_date = close, date
+    
+    # Only the first change after a fit has anything to drop
+    def _invalidate_models(self):
+        
+        if self.model_cache is not None and self._models_cached:
+            self.model_cache.invalidate(self.symbol)
+            self._models_cached = False
+    
+    # Add new daily bars after the last date
+    # rows is a frame like the provider's: a date index and price columns
+    # (columns the Stocker does not keep are ignored, missing ones are NaN)
+    @instrumented
+    def append(self, rows):
+        
+        rows = rows.sort_index()
+        rows.index = pd.DatetimeIndex(rows.index, name=self.stock.index.name)
+        
+        if rows.index[0] <= self.max_date:
+            raise ValueError('Appended rows must come after {}; use update() to change a bar.'.format(self.max_date))
+        
+        rows = rows.rename(columns={column: self.column_name(column) for column in rows.columns})
+        rows = rows.reindex(columns=self._stock.columns).astype(self._stock.dtypes.to_dict())
+        
+        self._stock = pd.concat([self._stock, rows])
+        
+        closes = self.column('y', rows)
+        for date, close in zip(rows.index, closes.to_numpy(dtype=float)):
+            if not np.isnan(close):
+                self._record_close(date, close)
+        
+        self._invalidate_models()
+    
+    # Set prices for one bar, e.g. update('2018-03-28', **{'Adj. Close': 94.2})
+    # (columns the Stocker does not keep are ignored, as in append)
+    # The date can be the last bar (an intraday tick) or a new day. Each call
+    # is constant time: the bar is held aside and written into the data the
+    # next time the data is read.
+    def update(self, date, **prices):
+        
+        date = pd.Timestamp(date)
+        
+        if date < self.max_date:
+            raise ValueError('Only the last bar ({}) or a new one can be updated.'.format(self.max_date))
+        
+        bar = self._pending.setdefault(date, {})
+        for name, value in prices.items():
+            name = self.column_name(name)
+            
+            # Stored with the column's type; columns not kept are ignored
+            if name in self._stock.columns:
+                bar[name] = self._stock[name].dtype.type(value)
+        
+        close_name = self.column_name('y')
+        if close_name in bar:
+            self._record_close(date, float(bar[close_name]))
+        elif date > self.max_date:
+            self.max_date = date
+        
+        self._invalidate_models()
+    
+    """
+    Return the positions bounding the rows between start_date and end_date.
+    Binary search on the sorted date index, so no scan of the data.
+    """
+    def date_bounds(self, start_date=None, end_date=None, include_start=True, include_end=True, df=None):
+        
+        if df is None:
+            df = self.stock
+        
+        dates = df.index if isinstance(df.index, pd.DatetimeIndex) else pd.DatetimeIndex(df['ds'] if 'ds' in df.columns else df['Date'])
+        
+        # Open ended ranges run to the ends of the data
+        start = 0
+        end = len(dates)
+        
+        if start_date is not None:
+            start = dates.searchsorted(pd.to_datetime(start_date), side='left' if include_start else 'right')
+        if end_date is not None:
+            end = dates.searchsorted(pd.to_datetime(end_date), side='right' if include_end else 'left')
+        
+        return start, max(start, end)
+    
+    """
+    Return the rows between start_date and end_date without copying them.
+    Either date can be None for an open range.
+    """
+    def slice_dates(self, start_date=None, end_date=None, include_start=True, include_end=True, df=None):
+        
+        if df is None:
+            df = self.stock
+        
+        start, end = self.date_bounds(start_date, end_date, include_start, include_end, df)
+        
+        return df.iloc[start:end]
+    
+    # Check if a date is a row in the data by binary search
+    def has_date(self, date, df=None):
+        
+        start, end = self.date_bounds(date, date, df=df)
+        
+        return end > start
+        
     """
     Return the dataframe trimmed to the specified range.
+    The result is a slice of the data, copy it before adding columns.
     """
+    @instrumented
     def make_df(self, start_date, end_date, df=None):
         
         # Default is to use the object stock data
-        if not df:
-            df = self.stock.copy()
-        
+        if df is None:
+            df = self.stock
         
         start_date, end_date = self.handle_dates(start_date, end_date)
         
-        # keep track of whether the start and end dates are in the data
-        start_in = True
-        end_in = True
-
-        # If user wants to round dates (default behavior)
-        if self.round_dates:
-            # Record if start and end date are in df
-            if (start_date not in list(df['Date'])):
-                start_in = False
-            if (end_date not in list(df['Date'])):
-                end_in = False
-
-            # If both are not in dataframe, round both
-            if (not end_in) & (not start_in):
-                trim_df = df[(df['Date'] >= start_date) & 
-                             (df['Date'] <= end_date)]
+        # If user wants to round dates (default behavior) the range is
+        # rounded in to the trading days it contains, so the inclusive
+        # slice is correct whether or not the ends are in the data
+        if not self.round_dates:
             
-            else:
-                # If both are in dataframe, round neither
-                if (end_in) & (start_in):
-                    trim_df = df[(df['Date'] >= start_date) & 
-                                 (df['Date'] <= end_date)]
-                else:
-                    # If only start is missing, round start
-                    if (not start_in):
-                        trim_df = df[(df['Date'] > start_date) & 
-                                     (df['Date'] <= end_date)]
-                    # If only end is imssing round end
-                    elif (not end_in):
-                        trim_df = df[(df['Date'] >= start_date) & 
-                                     (df['Date'] < end_date)]
-
-        
-        else:
-            valid_start = False
-            valid_end = False
-            while (not valid_start) & (not valid_end):
-                start_date, end_date = self.handle_dates(start_date, end_date)
+            # No round dates, if either data not in, print message and ask again
+            while not (self.has_date(start_date, df) and self.has_date(end_date, df)):
                 
-                # No round dates, if either data not in, print message and return
-                if (start_date in list(df['Date'])):
-                    valid_start = True
-                if (end_date in list(df['Date'])):
-                    valid_end = True
-                    
                 # Check to make sure dates are in the data
-                if (start_date not in list(df['Date'])):
+                if not self.has_date(start_date, df):
                     print('Start Date not in data (either out of range or not a trading day.)')
-                    start_date = pd.to_datetime(input(prompt='Enter a new start date: '))
+                    start_date = pd.to_datetime(input('Enter a new start date: '))
                     
-                elif (end_date not in list(df['Date'])):
+                elif not self.has_date(end_date, df):
                     print('End Date not in data (either out of range or not a trading day.)')
-                    end_date = pd.to_datetime(input(prompt='Enter a new end date: ') )
-
-            # Dates are not rounded
-            trim_df = df[(df['Date'] >= start_date) & 
-                         (df['Date'] <= end_date.date)]
-
+                    end_date = pd.to_datetime(input('Enter a new end date: '))
+                
+                start_date, end_date = self.handle_dates(start_date, end_date)
         
-            
-        return trim_df
+        return self.slice_dates(start_date, end_date, df=df)
 
 
     # Basic Historical Plots and Basic Statistics
+    # Returns a frame of the statistics, one row per stat
+    @instrumented
     def plot_stock(self, start_date=None, end_date=None, stats=['Adj. Close'], plot_type='basic'):
         
-        self.reset_plot()
-        
         if start_date is None:
             start_date = self.min_date
         if end_date is None:
@@ -232,32 +603,43 @@ class Stocker():
 
         colors = ['r', 'b', 'g', 'y', 'c', 'm']
         
+        summary = []
+        
+        if self.plotting():
+            self.begin_plot('fivethirtyeight')
+        
         for i, stat in enumerate(stats):
             
-            stat_min = min(stock_plot[stat])
-            stat_max = max(stock_plot[stat])
+            values = self.column(stat, stock_plot)
+            
+            stat_min = min(values)
+            stat_max = max(values)
 
-            stat_avg = np.mean(stock_plot[stat])
+            stat_avg = np.mean(values)
             
-            date_stat_min = stock_plot[stock_plot[stat] == stat_min]['Date']
-            date_stat_min = date_stat_min[date_stat_min.index[0]]
-            date_stat_max = stock_plot[stock_plot[stat] == stat_max]['Date']
-            date_stat_max = date_stat_max[date_stat_max.index[0]]
+            date_stat_min = values.idxmin()
+            date_stat_max = values.idxmax()
             
             print('Maximum {} = {:.2f} on {}.'.format(stat, stat_max, date_stat_max))
             print('Minimum {} = {:.2f} on {}.'.format(stat, stat_min, date_stat_min))
-            print('Current {} = {:.2f} on {}.\n'.format(stat, self.stock.loc[self.stock.index[-1], stat], self.max_date))
+            print('Current {} = {:.2f} on {}.\n'.format(stat, self.column(stat).iloc[-1], self.max_date))
+            
+            summary.append({'stat': stat, 'min': stat_min, 'min_date': date_stat_min,
+                            'max': stat_max, 'max_date': date_stat_max, 'mean': stat_avg,
+                            'current': self.column(stat).iloc[-1]})
+            
+            if not self.plotting():
+                continue
             
             # Percentage y-axis
             if plot_type == 'pct':
                 # Simple Plot 
-                plt.style.use('fivethirtyeight');
                 if stat == 'Daily Change':
-                    plt.plot(stock_plot['Date'], 100 * stock_plot[stat],
+                    plt.plot(stock_plot.index, 100 * values,
                          color = colors[i], linewidth = 2.4, alpha = 0.9,
                          label = stat)
                 else:
-                    plt.plot(stock_plot['Date'], 100 * (stock_plot[stat] -  stat_avg) / stat_avg,
+                    plt.plot(stock_plot.index, 100 * (values -  stat_avg) / stat_avg,
                          color = colors[i], linewidth = 2.4, alpha = 0.9,
                          label = stat)
 
@@ -267,18 +649,30 @@ class Stocker():
 
             # Stat y-axis
             elif plot_type == 'basic':
-                plt.style.use('fivethirtyeight');
-                plt.plot(stock_plot['Date'], stock_plot[stat], color = colors[i], linewidth = 3, label = stat, alpha = 0.8)
+                plt.plot(stock_plot.index, values, color = colors[i], linewidth = 3, label = stat, alpha = 0.8)
                 plt.xlabel('Date'); plt.ylabel('US $'); plt.title('%s Stock History' % self.symbol); 
                 plt.legend(prop={'size':10})
                 plt.grid(color = 'k', alpha = 0.4); 
       
-        plt.show();
+        summary = pd.DataFrame(summary).set_index('stat')
+        
+        if not self.plotting():
+            return summary
+        
+        self.show_plot('plot_stock')
+        
+        return summary
         
-    # Reset the plotting parameters to clear style formatting
+    # Reset the plotting parameters to clear style formatting, then apply style
+    # The parameters for each style are worked out once per process and
+    # applied with a single update afterwards
     # Not sure if this should be a static method
     @staticmethod
-    def reset_plot():
+    def reset_plot(style=None):
+        
+        if style in _plot_params:
+            matplotlib.rcParams.update(_plot_params[style])
+            return
         
         # Restore default parameters
         matplotlib.rcdefaults()
@@ -290,50 +684,90 @@ class Stocker():
         matplotlib.rcParams['ytick.labelsize'] = 8
         matplotlib.rcParams['axes.titlesize'] = 14
         matplotlib.rcParams['text.color'] = 'k'
+        
+        if style is not None:
+            plt.style.use(style)
+        
+        _plot_params[style] = {key: value for key, value in matplotlib.rcParams.items()
+                               if not key.startswith(SESSION_PARAMS)}
     
-    # Method to linearly interpolate prices on the weekends
-    def resample(self, dataframe):
-        # Change the index and resample at daily level
-        dataframe = dataframe.set_index('ds')
-        dataframe = dataframe.resample('D')
+    # Start a figure: time it as the plot stage and apply the style
+    def begin_plot(self, style=None):
         
-        # Reset the index and interpolate nan values
-        dataframe = dataframe.reset_index(level=0)
-        dataframe = dataframe.interpolate()
-        return dataframe
+        self._plot_stage = instrumentation.begin('plot')
+        self.reset_plot(style)
     
-    # Remove weekends from a dataframe
-    def remove_weekends(self, dataframe):
+    # Whether this call should draw figures at all
+    # Headless Stockers only draw when they have somewhere to save them
+    def plotting(self):
         
-        # Reset index to use ix
-        dataframe = dataframe.reset_index(drop=True)
+        return (not self.headless) or (self.plot_dir is not None)
+    
+    # Show the current figure, or in headless mode save it to plot_dir
+    # as <symbol>_<name>.png and close it
+    # The plot stage ends before an interactive window opens, so time spent
+    # looking at the figure is not counted
+    def show_plot(self, name):
+        
+        if not self.headless:
+            self._end_plot_stage()
+            plt.show()
+            return
         
-        weekends = []
+        if self.plot_dir is not None:
+            os.makedirs(self.plot_dir, exist_ok=True)
+            path = os.path.join(self.plot_dir, '%s_%s.png' % (self.symbol, name))
+            plt.savefig(path, bbox_inches='tight')
+            self.rendered_files.append(path)
         
-        # Find all of the weekends
-        for i, date in enumerate(dataframe['ds']):
-            if (date.weekday()) == 5 | (date.weekday() == 6):
-                weekends.append(i)
-            
-        # Drop the weekends
-        dataframe = dataframe.drop(weekends, axis=0)
+        plt.close('all')
+        self._end_plot_stage()
+    
+    def _end_plot_stage(self):
+        
+        instrumentation.end(getattr(self, '_plot_stage', None))
+        self._plot_stage = None
+    
+    # Method to linearly interpolate prices on the days without data
+    # Fills every calendar day by default (weekends included); with
+    # sessions_only only the exchange sessions missing from the data
+    def resample(self, dataframe, sessions_only=False):
+        # Change the index to the dates and keep the numeric columns
+        dataframe = dataframe.set_index('ds').select_dtypes(include=[np.number])
+        
+        if sessions_only:
+            dates = sessions(self.calendar, dataframe.index.min(), dataframe.index.max())
+        else:
+            dates = pd.date_range(dataframe.index.min(), dataframe.index.max(), freq='D')
+        
+        # Add the missing days and interpolate nan values
+        dataframe = dataframe.reindex(dates).interpolate()
+        dataframe['ds'] = dataframe.index
+        
+        return dataframe.reset_index(drop=True)
+    
+    # Remove weekends and exchange holidays from a dataframe
+    def remove_weekends(self, dataframe):
         
-        return dataframe
+        return filter_sessions(dataframe, self.calendar).reset_index(drop=True)
     
     
     # Calculate and plot profit from buying and holding shares for specified date range
+    # Returns the total profit and the profit on each day
+    @instrumented
     def buy_and_hold(self, start_date=None, end_date=None, nshares=1):
-        self.reset_plot()
         
         start_date, end_date = self.handle_dates(start_date, end_date)
             
+        # Trading days in the range
+        profits = self.make_df(start_date, end_date)
+        
         # Find starting and ending price of stock
-        start_price = float(self.stock[self.stock['Date'] == start_date]['Adj. Open'])
-        end_price = float(self.stock[self.stock['Date'] == end_date]['Adj. Close'])
+        start_price = float(self.column('Adj. Open', profits).iloc[0])
+        end_price = float(self.column('Adj. Close', profits).iloc[-1])
         
-        # Make a profit dataframe and calculate profit column
-        profits = self.make_df(start_date, end_date)
-        profits['hold_profit'] = nshares * (profits['Adj. Close'] - start_price)
+        # Calculate profit on each day
+        hold_profit = nshares * (self.column('Adj. Close', profits).astype(float) - start_price)
         
         # Total profit
         total_hold_profit = nshares * (end_price - start_price)
@@ -341,14 +775,17 @@ class Stocker():
         print('{} Total buy and hold profit from {} to {} for {} shares = ${:.2f}'.format
               (self.symbol, start_date, end_date, nshares, total_hold_profit))
         
+        if not self.plotting():
+            return total_hold_profit, hold_profit
+        
         # Plot the total profits 
-        plt.style.use('dark_background')
+        self.begin_plot('dark_background')
         
         # Location for number of profit
         text_location = (end_date - pd.DateOffset(months = 1))
         
         # Plot the profits over time
-        plt.plot(profits['Date'], profits['hold_profit'], 'b', linewidth = 3)
+        plt.plot(profits.index, hold_profit, 'b', linewidth = 3)
         plt.ylabel('Profit ($)'); plt.xlabel('Date'); plt.title('Buy and Hold Profits for {} {} to {}'.format(
                                                                 self.symbol, start_date, end_date))
         
@@ -360,47 +797,106 @@ class Stocker():
             size = 14)
         
         plt.grid(alpha=0.2)
-        plt.show();
+        self.show_plot('buy_and_hold')
+        
+        return total_hold_profit, hold_profit
         
+    # Model parameters of this Stocker, with any overrides applied
+    def model_params(self, **overrides):
+        
+        params = {'changepoint_prior_scale': self.changepoint_prior_scale,
+                  'daily_seasonality': self.daily_seasonality,
+                  'weekly_seasonality': self.weekly_seasonality,
+                  'monthly_seasonality': self.monthly_seasonality,
+                  'yearly_seasonality': self.yearly_seasonality,
+                  'changepoints': self.changepoints,
+                  'engine': self.engine}
+        
+        params.update(overrides)
+        
+        return params
+    
     # Create a prophet model without training
-    def create_model(self):
+    # Keyword arguments override the Stocker's model parameters
+    def create_model(self, **overrides):
 
-        # Make the model
-        model = fbprophet.Prophet(daily_seasonality=self.daily_seasonality,  
-                                  weekly_seasonality=self.weekly_seasonality, 
-                                  yearly_seasonality=self.yearly_seasonality,
-                                  changepoint_prior_scale=self.changepoint_prior_scale,
-                                  changepoints=self.changepoints)
+        return build_model(self.model_params(**overrides))
+    
+    # Fit a model on train, reusing the cached model when the same
+    # window of the same data was already fit with the same parameters
+    @instrumented
+    def fit_model(self, train, **overrides):
+        
+        params = self.model_params(**overrides)
+        key = cache_key(self.symbol, train, params)
+        
+        model = self.model_cache.get(key) if self.model_cache is not None else None
+        
+        if model is None:
+            model = build_model(params)
+            with stage('fit'):
+                model.fit(train)
+            
+            if self.model_cache is not None:
+                self.model_cache.put(key, model)
         
-        if self.monthly_seasonality:
-            # Add monthly seasonality
-            model.add_seasonality(name = 'monthly', period = 30.5, fourier_order = 5)
+        self._models_cached = True
         
         return model
     
+    # Forecasts periods days past train for each set of parameter overrides,
+    # in order. Models not in the cache are fit across max_workers processes.
+    # uncertainty_samples is passed on to predict_model
+    @instrumented
+    def fit_grid(self, train, overrides_list, periods, max_workers=None, uncertainty_samples=None):
+        
+        params_list = [self.model_params(**overrides) for overrides in overrides_list]
+        keys = [cache_key(self.symbol, train, params) for params in params_list]
+        
+        models = [self.model_cache.get(key) if self.model_cache is not None else None for key in keys]
+        forecasts = [None] * len(models)
+        
+        # Fit the missing models concurrently
+        missing = [i for i, model in enumerate(models) if model is None]
+        jobs = [(params_list[i], train[['ds', 'y']], periods, self.calendar, uncertainty_samples) for i in missing]
+        
+        with stage('fit'):
+            fitted = pool_map(fit_and_predict, jobs, max_workers=max_workers)
+        
+        for i, (model, future) in zip(missing, fitted):
+            models[i] = model
+            forecasts[i] = future
+            
+            if self.model_cache is not None:
+                self.model_cache.put(keys[i], model)
+        
+        self._models_cached = True
+        
+        # Cached models only need to predict
+        for i, model in enumerate(models):
+            if forecasts[i] is None:
+                with stage('predict'):
+                    forecasts[i] = predict_model(model, periods, self.calendar, uncertainty_samples)
+        
+        return forecasts
+    
     # Graph the effects of altering the changepoint prior scale (cps)
-    def changepoint_prior_analysis(self, changepoint_priors=[0.001, 0.05, 0.1, 0.2], colors=['b', 'r', 'grey', 'gold']):
+    # The models are fit across max_workers processes (default one per core)
+    @instrumented
+    def changepoint_prior_analysis(self, changepoint_priors=[0.001, 0.05, 0.1, 0.2], colors=['b', 'r', 'grey', 'gold'], max_workers=None):
     
         # Training and plotting with specified years of data
-        train = self.stock[(self.stock['Date'] > (max(self.stock['Date']) - pd.DateOffset(years=self.training_years)))]
+        train = self.prophet_df(self.max_date - pd.DateOffset(years=self.training_years), include_start=False)
         
-        # Iterate through all the changepoints and make models
-        for i, prior in enumerate(changepoint_priors):
-            # Select the changepoint
-            self.changepoint_prior_scale = prior
-            
-            # Create and train a model with the specified cps
-            model = self.create_model()
-            model.fit(train)
-            future = model.make_future_dataframe(periods=180, freq='D')
-            
-            # Make a dataframe to hold predictions
-            if i == 0:
-                predictions = future.copy()
-                
-            future = model.predict(future)
-            
-            # Fill in prediction dataframe
+        # Fit a model for each changepoint prior concurrently
+        forecasts = self.fit_grid(train, [{'changepoint_prior_scale': prior} for prior in changepoint_priors],
+                                  180, max_workers)
+        
+        # Make a dataframe to hold predictions
+        predictions = forecasts[0][['ds']].copy()
+        
+        # Fill in prediction dataframe in the order of the priors
+        for prior, future in zip(changepoint_priors, forecasts):
             predictions['%.3f_yhat_upper' % prior] = future['yhat_upper']
             predictions['%.3f_yhat_lower' % prior] = future['yhat_lower']
             predictions['%.3f_yhat' % prior] = future['yhat']
@@ -408,9 +904,11 @@ class Stocker():
         # Remove the weekends
         predictions = self.remove_weekends(predictions)
         
+        if not self.plotting():
+            return predictions
+        
         # Plot set-up
-        self.reset_plot()
-        plt.style.use('fivethirtyeight')
+        self.begin_plot('fivethirtyeight')
         fig, ax = plt.subplots(1, 1)
         
         # Actual observations
@@ -431,26 +929,26 @@ class Stocker():
         # Plot labels
         plt.legend(loc = 2, prop={'size': 10})
         plt.xlabel('Date'); plt.ylabel('Stock Price ($)'); plt.title('Effect of Changepoint Prior Scale');
-        plt.show()
+        self.show_plot('changepoint_prior_analysis')
+        
+        return predictions
             
     # Basic prophet model for specified number of days  
-    def create_prophet_model(self, days=0, resample=False):
-        
-        self.reset_plot()
-        
-        model = self.create_model()
+    # engine overrides Stocker.engine for this call
+    @instrumented
+    def create_prophet_model(self, days=0, resample=False, engine=None):
         
         # Fit on the stock history for self.training_years number of years
-        stock_history = self.stock[self.stock['Date'] > (self.max_date - pd.DateOffset(years = self.training_years))]
+        stock_history = self.prophet_df(self.max_date - pd.DateOffset(years = self.training_years), include_start=False)
         
         if resample:
             stock_history = self.resample(stock_history)
         
-        model.fit(stock_history)
+        model = self.fit_model(stock_history, engine=engine or self.engine)
         
-        # Make and predict for next year with future dataframe
-        future = model.make_future_dataframe(periods = days, freq='D')
-        future = model.predict(future)
+        # Make and predict for the trading sessions in the next days
+        with stage('predict'):
+            future = predict_model(model, days, self.calendar)
         
         if days > 0:
             # Print the predicted price
@@ -461,7 +959,11 @@ class Stocker():
         else:
             title = '%s Historical and Modeled Stock Price' % self.symbol
         
+        if not self.plotting():
+            return model, future
+        
         # Set up the plot
+        self.begin_plot()
         fig, ax = plt.subplots(1, 1)
 
         # Plot the actual values
@@ -478,12 +980,20 @@ class Stocker():
         plt.legend(loc = 2, prop={'size': 10}); plt.xlabel('Date'); plt.ylabel('Price $');
         plt.grid(linewidth=0.6, alpha = 0.6)
         plt.title(title);
-        plt.show()
+        self.show_plot('create_prophet_model')
         
         return model, future
       
     # Evaluate prediction model for one year
-    def evaluate_prediction(self, start_date=None, end_date=None, nshares = None):
+    # engine overrides Stocker.engine for this call
+    # uncertainty_samples defaults to self.evaluation_samples; 0 skips the
+    # prediction intervals when only the point errors are needed
+    @instrumented
+    def evaluate_prediction(self, start_date=None, end_date=None, nshares = None, engine=None,
+                            uncertainty_samples=None):
+        
+        if uncertainty_samples is None:
+            uncertainty_samples = self.evaluation_samples
         
         # Default start date is one year before end of data
         # Default end date is end date of data
@@ -495,51 +1005,27 @@ class Stocker():
         start_date, end_date = self.handle_dates(start_date, end_date)
         
         # Training data starts self.training_years years before start date and goes up to start date
-        train = self.stock[(self.stock['Date'] < start_date) & 
-                           (self.stock['Date'] > (start_date - pd.DateOffset(years=self.training_years)))]
+        train = self.prophet_df(start_date - pd.DateOffset(years=self.training_years), start_date,
+                                include_start=False, include_end=False)
         
         # Testing data is specified in the range
-        test = self.stock[(self.stock['Date'] >= start_date) & (self.stock['Date'] <= end_date)]
+        test = self.prophet_df(start_date, end_date)
         
         # Create and train the model
-        model = self.create_model()
-        model.fit(train)
+        model = self.fit_model(train, engine=engine or self.engine)
         
-        # Make a future dataframe and predictions
-        future = model.make_future_dataframe(periods = 365, freq='D')
-        future = model.predict(future)
+        # Make predictions for the trading sessions in the next year
+        with stage('predict'):
+            future = predict_model(model, 365, self.calendar, uncertainty_samples)
         
         # Merge predictions with the known values
-        test = pd.merge(test, future, on = 'ds', how = 'inner')
-
-        train = pd.merge(train, future, on = 'ds', how = 'inner')
-        
-        # Calculate the differences between consecutive measurements
-        test['pred_diff'] = test['yhat'].diff()
-        test['real_diff'] = test['y'].diff()
+        with stage('merge'):
+            test = pd.merge(test, future, on = 'ds', how = 'inner')
 
-        # Correct is when we predicted the correct direction
-        test['correct'] = (np.sign(test['pred_diff'][1:]) == np.sign(test['real_diff'][1:])) * 1
+            train = pd.merge(train, future, on = 'ds', how = 'inner')
         
-        # Accuracy when we predict increase and decrease
-        increase_accuracy = 100 * np.mean(test[test['pred_diff'] > 0]['correct'])
-        decrease_accuracy = 100 * np.mean(test[test['pred_diff'] < 0]['correct'])
-
-        # Calculate mean absolute error
-        test_errors = abs(test['y'] - test['yhat'])
-        test_mean_error = np.mean(test_errors)
-
-        train_errors = abs(train['y'] - train['yhat'])
-        train_mean_error = np.mean(train_errors)
-
-        # Calculate percentage of time actual value within prediction range
-        test['in_range'] = False
-
-        for i in test.index:
-            if (test.loc[i, 'y'] < test.loc[i, 'yhat_upper']) & (test.loc[i, 'y'] > test.loc[i, 'yhat_lower']):
-                test.loc[i, 'in_range'] = True
-
-        in_range_accuracy = 100 * np.mean(test['in_range'])
+        # Score the predictions against the known values
+        metrics = score_prediction(train, test, start_date, end_date, nshares, model.interval_width)
 
         if not nshares:
 
@@ -551,18 +1037,23 @@ class Stocker():
             print('\nPredicted price on {} = ${:.2f}.'.format(max(future['ds']), future.loc[future.index[-1], 'yhat']))
             print('Actual price on    {} = ${:.2f}.\n'.format(max(test['ds']), test.loc[test.index[-1], 'y']))
 
-            print('Average Absolute Error on Training Data = ${:.2f}.'.format(train_mean_error))
-            print('Average Absolute Error on Testing  Data = ${:.2f}.\n'.format(test_mean_error))
+            print('Average Absolute Error on Training Data = ${:.2f}.'.format(metrics.train_error))
+            print('Average Absolute Error on Testing  Data = ${:.2f}.\n'.format(metrics.test_error))
 
             # Direction accuracy
-            print('When the model predicted an increase, the price increased {:.2f}% of the time.'.format(increase_accuracy))
-            print('When the model predicted a  decrease, the price decreased  {:.2f}% of the time.\n'.format(decrease_accuracy))
+            print('When the model predicted an increase, the price increased {:.2f}% of the time.'.format(metrics.increase_accuracy))
+            print('When the model predicted a  decrease, the price decreased  {:.2f}% of the time.\n'.format(metrics.decrease_accuracy))
 
-            print('The actual value was within the {:d}% confidence interval {:.2f}% of the time.'.format(int(100 * model.interval_width), in_range_accuracy))
+            if metrics.in_range_accuracy is not None:
+                print('The actual value was within the {:d}% confidence interval {:.2f}% of the time.'.format(int(100 * model.interval_width), metrics.in_range_accuracy))
+            else:
+                print('The confidence interval was not sampled, so its accuracy is not available.')
 
+            if not self.plotting():
+                return metrics
 
              # Reset the plot
-            self.reset_plot()
+            self.begin_plot()
             
             # Set up the plot
             fig, ax = plt.subplots(1, 1)
@@ -574,12 +1065,15 @@ class Stocker():
             # Plot the predicted values
             ax.plot(future['ds'], future['yhat'], 'navy', linewidth = 2.4, label = 'Predicted');
 
-            # Plot the uncertainty interval as ribbon
-            ax.fill_between(future['ds'].dt.to_pydatetime(), future['yhat_upper'], future['yhat_lower'], alpha = 0.6, 
-                           facecolor = 'gold', edgecolor = 'k', linewidth = 1.4, label = 'Confidence Interval')
+            # Plot the uncertainty interval as ribbon, when it was sampled
+            lower = future.get('yhat_lower', future['yhat'])
+            upper = future.get('yhat_upper', future['yhat'])
+            if 'yhat_lower' in future.columns:
+                ax.fill_between(future['ds'].dt.to_pydatetime(), upper, lower, alpha = 0.6, 
+                               facecolor = 'gold', edgecolor = 'k', linewidth = 1.4, label = 'Confidence Interval')
 
             # Put a vertical line at the start of predictions
-            plt.vlines(x=min(test['ds']), ymin=min(future['yhat_lower']), ymax=max(future['yhat_upper']), colors = 'r',
+            plt.vlines(x=min(test['ds']), ymin=min(lower), ymax=max(upper), colors = 'r',
                        linestyles='dashed', label = 'Prediction Start')
 
             # Plot formatting
@@ -588,54 +1082,32 @@ class Stocker():
                        
             plt.title('{} Model Evaluation from {} to {}.'.format(self.symbol,
                 start_date, end_date));
-            plt.show();
+            self.show_plot('evaluate_prediction')
 
         
         # If a number of shares is specified, play the game
         elif nshares:
             
-            # Only playing the stocks when we predict the stock will increase
-            test_pred_increase = test[test['pred_diff'] > 0]
-            
-            test_pred_increase.reset_index(inplace=True)
-            prediction_profit = []
-            
-            # Iterate through all the predictions and calculate profit from playing
-            for i, correct in enumerate(test_pred_increase['correct']):
-                
-                # If we predicted up and the price goes up, we gain the difference
-                if correct == 1:
-                    prediction_profit.append(nshares * test_pred_increase.loc[i, 'real_diff'])
-                # If we predicted up and the price goes down, we lose the difference
-                else:
-                    prediction_profit.append(nshares * test_pred_increase.loc[i, 'real_diff'])
-            
-            test_pred_increase['pred_profit'] = prediction_profit
-            
-            # Put the profit into the test dataframe
-            test = pd.merge(test, test_pred_increase[['ds', 'pred_profit']], on = 'ds', how = 'left')
-            test.loc[0, 'pred_profit'] = 0
-        
             # Profit for either method at all dates
-            test['pred_profit'] = test['pred_profit'].cumsum().ffill()
-            test['hold_profit'] = nshares * (test['y'] - float(test.loc[0, 'y']))
+            test['pred_profit'], test['hold_profit'] = strategy_profit(test['y'], test['yhat'], nshares)
             
             # Display information
             print('You played the stock market in {} from {} to {} with {} shares.\n'.format(
                 self.symbol, start_date, end_date, nshares))
             
-            print('When the model predicted an increase, the price increased {:.2f}% of the time.'.format(increase_accuracy))
-            print('When the model predicted a  decrease, the price decreased  {:.2f}% of the time.\n'.format(decrease_accuracy))
+            print('When the model predicted an increase, the price increased {:.2f}% of the time.'.format(metrics.increase_accuracy))
+            print('When the model predicted a  decrease, the price decreased  {:.2f}% of the time.\n'.format(metrics.decrease_accuracy))
 
             # Display some friendly information about the perils of playing the stock market
-            print('The total profit using the Prophet model = ${:.2f}.'.format(np.sum(prediction_profit)))
-            print('The Buy and Hold strategy profit =         ${:.2f}.'.format(float(test.loc[test.index[-1], 'hold_profit'])))
+            print('The total profit using the Prophet model = ${:.2f}.'.format(metrics.prediction_profit))
+            print('The Buy and Hold strategy profit =         ${:.2f}.'.format(metrics.hold_profit))
             print('\nThanks for playing the stock market!\n')
             
-           
+            if not self.plotting():
+                return metrics
             
             # Plot the predicted and actual profits over time
-            self.reset_plot()
+            self.begin_plot('dark_background')
             
             # Final profit and final smart used for locating text
             final_profit = test.loc[test.index[-1], 'pred_profit']
@@ -645,8 +1117,6 @@ class Stocker():
             last_date = test.loc[test.index[-1], 'ds']
             text_location = (last_date - pd.DateOffset(months = 1))
 
-            plt.style.use('dark_background')
-
             # Plot smart profits
             plt.plot(test['ds'], test['hold_profit'], 'b',
                      linewidth = 1.8, label = 'Buy and Hold Strategy') 
@@ -674,45 +1144,54 @@ class Stocker():
             plt.title('Predicted versus Buy and Hold Profits');
             plt.legend(loc = 2, prop={'size': 10});
             plt.grid(alpha=0.2); 
-            plt.show()
+            self.show_plot('evaluate_prediction_profits')
         
-    def retrieve_google_trends(self, search, date_range):
+        return metrics
         
-        # Set up the trend fetching object
-        pytrends = TrendReq(hl='en-US', tz=360)
-        kw_list = [search]
+    # Google news search interest and related queries for a term
+    # Repeated calls for the same window are answered from the trends cache
+    @instrumented
+    def retrieve_google_trends(self, search, date_range):
 
         try:
         
-            # Create the search object
-            pytrends.build_payload(kw_list, cat=0, timeframe=date_range[0], geo='', gprop='news')
-            
             # Retrieve the interest over time
-            trends = pytrends.interest_over_time()
+            trends = self.trends_client.interest_over_time(search, date_range[0], gprop='news')
 
-            related_queries = pytrends.related_queries()
+            related_queries = self.trends_client.related_queries(search, date_range[0], gprop='news')
 
         except Exception as e:
             print('\nGoogle Search Trend retrieval failed.')
             print(e)
-            return
+            return None, None
         
         return trends, related_queries
+    
+    # Google Trends timeframe searched by changepoint_date_analysis
+    # Fetch many terms for it at once with
+    # stocker.trends_client.fetch(terms, stocker.trends_timeframe(), gprop='news')
+    def trends_timeframe(self):
         
-    def changepoint_date_analysis(self, search=None):
-        self.reset_plot()
-
-        model = self.create_model()
+        train = self.prophet_df(self.max_date - pd.DateOffset(years = self.training_years), include_start=False)
+        return '%s %s' % (train['ds'].min().date(), train['ds'].max().date())
         
+    # engine overrides Stocker.engine for this call
+    # Returns the largest changepoints
+    @instrumented
+    def changepoint_date_analysis(self, search=None, engine=None):
+
         # Use past self.training_years years of data
-        train = self.stock[self.stock['Date'] > (self.max_date - pd.DateOffset(years = self.training_years))]
-        model.fit(train)
+        train = self.prophet_df(self.max_date - pd.DateOffset(years = self.training_years), include_start=False,
+                                columns=['Adj. Close'])
+        model = self.fit_model(train, engine=engine or self.engine)
         
         # Predictions of the training data (no future periods)
-        future = model.make_future_dataframe(periods=0, freq='D')
-        future = model.predict(future)
+        with stage('predict'):
+            future = model.make_future_dataframe(periods=0, freq='D')
+            future = model.predict(future)
     
-        train = pd.merge(train, future[['ds', 'yhat']], on = 'ds', how = 'inner')
+        with stage('merge'):
+            train = pd.merge(train, future[['ds', 'yhat']], on = 'ds', how = 'inner')
         
         changepoints = model.changepoints
         train = train.reset_index(drop=True)
@@ -742,10 +1221,13 @@ class Stocker():
         if not search:
         
             print('\nChangepoints sorted by slope rate of change (2nd derivative):\n')
-            print(c_data.loc[:, ['Date', 'Adj. Close', 'delta']][:5])
+            print(c_data.loc[:, ['ds', 'Adj. Close', 'delta']].rename(columns={'ds': 'Date'})[:5])
+
+            if not self.plotting():
+                return c_data
 
             # Line plot showing actual values, estimated values, and changepoints
-            self.reset_plot()
+            self.begin_plot()
             
             # Set up line plot 
             plt.plot(train['ds'], train['y'], 'ko', ms = 4, label = 'Stock Price')
@@ -762,20 +1244,20 @@ class Stocker():
 
             plt.legend(prop={'size':10});
             plt.xlabel('Date'); plt.ylabel('Price ($)'); plt.title('Stock Price with Changepoints')
-            plt.show()
+            self.show_plot('changepoint_date_analysis')
         
         # Search for search term in google news
         # Show related queries, rising related queries
         # Graph changepoints, search frequency, stock price
         if search:
-            date_range = ['%s %s' % (str(min(train['Date'])), str(max(train['Date'])))]
+            date_range = [self.trends_timeframe()]
 
             # Get the Google Trends for specified terms and join to training dataframe
             trends, related_queries = self.retrieve_google_trends(search, date_range)
 
             if (trends is None)  or (related_queries is None):
                 print('No search trends found for %s' % search)
-                return
+                return c_data
 
             print('\n Top Related Queries: \n')
             print(related_queries[search]['top'].head())
@@ -784,7 +1266,7 @@ class Stocker():
             print(related_queries[search]['rising'].head())
 
             # Upsample the data for joining with training data
-            trends = trends.resample('D')
+            trends = trends.resample('D').asfreq()
 
             trends = trends.reset_index(level=0)
             trends = trends.rename(columns={'date': 'ds', search: 'freq'})
@@ -793,13 +1275,17 @@ class Stocker():
             trends['freq'] = trends['freq'].interpolate()
 
             # Merge with the training data
-            train = pd.merge(train, trends, on = 'ds', how = 'inner')
+            with stage('merge'):
+                train = pd.merge(train, trends, on = 'ds', how = 'inner')
 
             # Normalize values
             train['y_norm'] = train['y'] / max(train['y'])
             train['freq_norm'] = train['freq'] / max(train['freq'])
             
-            self.reset_plot()
+            if not self.plotting():
+                return c_data
+            
+            self.begin_plot()
 
             # Plot the normalized stock price and normalize search frequency
             plt.plot(train['ds'], train['y_norm'], 'k-', label = 'Stock Price')
@@ -817,39 +1303,17 @@ class Stocker():
             # Plot formatting
             plt.legend(prop={'size': 10})
             plt.xlabel('Date'); plt.ylabel('Normalized Values'); plt.title('%s Stock Price and Search Frequency for %s' % (self.symbol, search))
-            plt.show()
-        
-    # Predict the future price for a given range of days
-    def predict_future(self, days=30):
-        
-        # Use past self.training_years years for training
-        train = self.stock[self.stock['Date'] > (max(self.stock['Date']) - pd.DateOffset(years=self.training_years))]
-        
-        model = self.create_model()
-        
-        model.fit(train)
+            self.show_plot('changepoint_search')
         
-        # Future dataframe with specified number of days to predict
-        future = model.make_future_dataframe(periods=days, freq='D')
-        future = model.predict(future)
+        return c_data
         
-        # Only concerned with future dates
-        future = future[future['ds'] >= max(self.stock['Date'])]
+    # Predict the future price for a given range of days
+    # engine overrides Stocker.engine for this call
+    # Returns the predictions
+    @instrumented
+    def predict_future(self, days=30, engine=None):
         
-        # Remove the weekends
-        future = self.remove_weekends(future)
-        
-        # Calculate whether increase or not
-        future['diff'] = future['yhat'].diff()
-    
-        future = future.dropna()
-
-        # Find the prediction direction and create separate dataframes
-        future['direction'] = (future['diff'] > 0) * 1
-        
-        # Rename the columns for presentation
-        future = future.rename(columns={'ds': 'Date', 'yhat': 'estimate', 'diff': 'change', 
-                                        'yhat_upper': 'upper', 'yhat_lower': 'lower'})
+        future = self.forecast(days, engine)
         
         future_increase = future[future['direction'] == 1]
         future_decrease = future[future['direction'] == 0]
@@ -861,10 +1325,11 @@ class Stocker():
         print('\nPredicted Decrease: \n')
         print(future_decrease[['Date', 'estimate', 'change', 'upper', 'lower']])
         
-        self.reset_plot()
+        if not self.plotting():
+            return future
         
         # Set up plot
-        plt.style.use('fivethirtyeight')
+        self.begin_plot('fivethirtyeight')
         matplotlib.rcParams['axes.labelsize'] = 10
         matplotlib.rcParams['xtick.labelsize'] = 8
         matplotlib.rcParams['ytick.labelsize'] = 8
@@ -888,10 +1353,50 @@ class Stocker():
         plt.xticks(rotation = '45')
         plt.ylabel('Predicted Stock Price (US $)');
         plt.xlabel('Date'); plt.title('Predictions for %s' % self.symbol);
-        plt.show()
+        self.show_plot('predict_future')
+        
+        return future
+    
+    # Predictions for the trading sessions in the next days, without printing
+    # or plotting: Date, estimate, change, upper, lower and direction (1 up, 0 down)
+    @instrumented
+    def forecast(self, days=30, engine=None):
+        
+        # Use past self.training_years years for training
+        train = self.prophet_df(self.max_date - pd.DateOffset(years=self.training_years), include_start=False)
+        
+        model = self.fit_model(train, engine=engine or self.engine)
+        
+        # Predict the trading sessions in the specified number of days
+        with stage('predict'):
+            future = predict_model(model, days, self.calendar)
         
-    def changepoint_prior_validation(self, start_date=None, end_date=None,changepoint_priors = [0.001, 0.05, 0.1, 0.2]):
+        # Only concerned with future dates
+        future = future[future['ds'] >= self.max_date].reset_index(drop=True)
+        
+        # Calculate whether increase or not
+        future['diff'] = future['yhat'].diff()
+    
+        future = future.dropna()
 
+        # Find the prediction direction and create separate dataframes
+        future['direction'] = (future['diff'] > 0) * 1
+        
+        # Rename the columns for presentation
+        future = future.rename(columns={'ds': 'Date', 'yhat': 'estimate', 'diff': 'change', 
+                                        'yhat_upper': 'upper', 'yhat_lower': 'lower'})
+        
+        return future
+        
+    # The models are fit across max_workers processes (default one per core)
+    # uncertainty_samples defaults to self.evaluation_samples; with 0 the
+    # train_range and test_range columns are NaN
+    @instrumented
+    def changepoint_prior_validation(self, start_date=None, end_date=None,changepoint_priors = [0.001, 0.05, 0.1, 0.2], max_workers=None,
+                                     uncertainty_samples=None):
+
+        if uncertainty_samples is None:
+            uncertainty_samples = self.evaluation_samples
 
         # Default start date is two years before end of data
         # Default end date is one year before end of data
@@ -907,57 +1412,49 @@ class Stocker():
         start_date, end_date = self.handle_dates(start_date, end_date)
                                
         # Select self.training_years number of years
-        train = self.stock[(self.stock['Date'] > (start_date - pd.DateOffset(years=self.training_years))) & 
-        (self.stock['Date'] < start_date)]
+        train = self.prophet_df(start_date - pd.DateOffset(years=self.training_years), start_date,
+                                include_start=False, include_end=False)
         
         # Testing data is specified by range
-        test = self.stock[(self.stock['Date'] >= start_date) & (self.stock['Date'] <= end_date)]
+        test = self.prophet_df(start_date, end_date)
 
-        eval_days = (max(test['Date']) - min(test['Date'])).days
+        eval_days = (max(test['ds']) - min(test['ds'])).days
         
-        results = pd.DataFrame(0, index = list(range(len(changepoint_priors))), 
+        results = pd.DataFrame(0.0, index = list(range(len(changepoint_priors))), 
             columns = ['cps', 'train_err', 'train_range', 'test_err', 'test_range'])
 
-        print('\nValidation Range {} to {}.\n'.format(min(test['Date']),
-            max(test['Date'])))
+        print('\nValidation Range {} to {}.\n'.format(min(test['ds']),
+            max(test['ds'])))
             
         
-        # Iterate through all the changepoints and make models
-        for i, prior in enumerate(changepoint_priors):
+        # Fit a model for each changepoint prior concurrently
+        forecasts = self.fit_grid(train, [{'changepoint_prior_scale': prior} for prior in changepoint_priors],
+                                  eval_days, max_workers, uncertainty_samples)
+        
+        # Score the models in the order of the priors
+        for i, (prior, future) in enumerate(zip(changepoint_priors, forecasts)):
             results.loc[i, 'cps'] = prior
             
-            # Select the changepoint
-            self.changepoint_prior_scale = prior
+            # Training and testing results and metrics
+            columns = [column for column in ['ds', 'yhat', 'yhat_upper', 'yhat_lower'] if column in future.columns]
+            with stage('merge'):
+                train_results = pd.merge(train, future[columns], on = 'ds', how = 'inner')
+                test_results = pd.merge(test, future[columns], on = 'ds', how = 'inner')
             
-            # Create and train a model with the specified cps
-            model = self.create_model()
-            model.fit(train)
-            future = model.make_future_dataframe(periods=eval_days, freq='D')
-                
-            future = model.predict(future)
-            
-            # Training results and metrics
-            train_results = pd.merge(train, future[['ds', 'yhat', 'yhat_upper', 'yhat_lower']], on = 'ds', how = 'inner')
-            avg_train_error = np.mean(abs(train_results['y'] - train_results['yhat']))
-            avg_train_uncertainty = np.mean(abs(train_results['yhat_upper'] - train_results['yhat_lower']))
-            
-            results.loc[i, 'train_err'] = avg_train_error
-            results.loc[i, 'train_range'] = avg_train_uncertainty
+            scores = score_prediction(train_results, test_results, start_date, end_date)
             
-            # Testing results and metrics
-            test_results = pd.merge(test, future[['ds', 'yhat', 'yhat_upper', 'yhat_lower']], on = 'ds', how = 'inner')
-            avg_test_error = np.mean(abs(test_results['y'] - test_results['yhat']))
-            avg_test_uncertainty = np.mean(abs(test_results['yhat_upper'] - test_results['yhat_lower']))
-            
-            results.loc[i, 'test_err'] = avg_test_error
-            results.loc[i, 'test_range'] = avg_test_uncertainty
+            results.loc[i, 'train_err'] = scores.train_error
+            results.loc[i, 'train_range'] = scores.train_uncertainty
+            results.loc[i, 'test_err'] = scores.test_error
+            results.loc[i, 'test_range'] = scores.test_uncertainty
 
         print(results)
 
-
+        if not self.plotting():
+            return results
         
         # Plot of training and testing average errors
-        self.reset_plot()
+        self.begin_plot()
         
         plt.plot(results['cps'], results['train_err'], 'bo-', ms = 8, label = 'Train Error')
         plt.plot(results['cps'], results['test_err'], 'r*-', ms = 8, label = 'Test Error')
@@ -966,10 +1463,13 @@ class Stocker():
         plt.grid(color='k', alpha=0.3)
         plt.xticks(results['cps'], results['cps'])
         plt.legend(prop={'size':10})
-        plt.show();
+        self.show_plot('changepoint_prior_errors')
+        
+        if results['test_range'].isna().all():
+            return results
         
         # Plot of training and testing average uncertainty
-        self.reset_plot()
+        self.begin_plot()
 
         plt.plot(results['cps'], results['train_range'], 'bo-', ms = 8, label = 'Train Range')
         plt.plot(results['cps'], results['test_range'], 'r*-', ms = 8, label = 'Test Range')
@@ -978,4 +1478,6 @@ class Stocker():
         plt.grid(color='k', alpha=0.3)
         plt.xticks(results['cps'], results['cps'])
         plt.legend(prop={'size':10})
-        plt.show();
\ No newline at end of file
+        self.show_plot('changepoint_prior_uncertainty')
+        
+        return results
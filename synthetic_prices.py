@@ -0,0 +1,83 @@
+# Synthetic daily price histories for running Stocker offline
+# Closing prices follow a geometric Brownian motion whose drift and volatility
+# switch between market regimes, on the trading sessions of an exchange.
+# The frames have the same columns as the Quandl WIKI data.
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from trading_calendar import sessions
+
+# Annualised drift and volatility of a market regime, and the expected
+# number of trading days it lasts
+Regime = namedtuple('Regime', ['name', 'drift', 'volatility', 'mean_days'])
+
+DEFAULT_REGIMES = [Regime('bull', 0.15, 0.15, 500),
+                   Regime('bear', -0.20, 0.30, 150),
+                   Regime('sideways', 0.02, 0.12, 250)]
+
+TRADING_DAYS = 252
+
+
+# Regime index for each of n days: each regime lasts a geometric number of
+# days with its mean_days, then a different regime is picked at random
+def regime_path(n, regimes, rng):
+    path = np.empty(n, dtype=int)
+    day = 0
+    current = rng.integers(len(regimes))
+
+    while day < n:
+        length = rng.geometric(1 / regimes[current].mean_days)
+        path[day:day + length] = current
+        day += length
+
+        if len(regimes) > 1:
+            current = (current + rng.integers(1, len(regimes))) % len(regimes)
+
+    return path
+
+
+# Provider-style frame (Date index; Open, High, Low, Close, Volume,
+# Ex-Dividend, Split Ratio and the Adj. columns) covering years of sessions
+# ending at end_date. The same seed always gives the same prices.
+def synthetic_stock(years=10, end_date='2018-03-27', start_price=50.0, regimes=None,
+                    calendar='NYSE', seed=0):
+    if regimes is None:
+        regimes = DEFAULT_REGIMES
+
+    rng = np.random.default_rng(seed)
+
+    end_date = pd.Timestamp(end_date)
+    dates = sessions(calendar, end_date - pd.DateOffset(years=years) + pd.DateOffset(days=1), end_date)
+    n = len(dates)
+
+    path = regime_path(n, regimes, rng)
+    drift = np.array([regime.drift for regime in regimes])[path] / TRADING_DAYS
+    volatility = np.array([regime.volatility for regime in regimes])[path] / np.sqrt(TRADING_DAYS)
+
+    # Log returns of the GBM, then an overnight gap and an intraday range
+    log_returns = drift - volatility ** 2 / 2 + volatility * rng.standard_normal(n)
+    close = start_price * np.exp(np.cumsum(log_returns))
+
+    previous_close = np.concatenate([[start_price], close[:-1]])
+    open_ = previous_close * np.exp(0.25 * volatility * rng.standard_normal(n))
+
+    spread = np.abs(volatility * rng.standard_normal(n))
+    high = np.maximum(open_, close) * (1 + spread / 2)
+    low = np.minimum(open_, close) * (1 - spread / 2)
+
+    volume = np.round(1e6 * np.exp(0.5 * rng.standard_normal(n)) * (1 + 10 * volatility))
+
+    stock = pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume,
+                          'Ex-Dividend': 0.0, 'Split Ratio': 1.0,
+                          'Adj. Open': open_, 'Adj. High': high, 'Adj. Low': low, 'Adj. Close': close,
+                          'Adj. Volume': volume},
+                         index=pd.DatetimeIndex(dates, name='Date'))
+
+    return stock
+
+
+# Synthetic frames for many tickers: ticker -> frame, each with its own seed
+def synthetic_universe(tickers, years=10, seed=0, **kwargs):
+    return {ticker: synthetic_stock(years, seed=seed + i, **kwargs) for i, ticker in enumerate(tickers)}
@@ -0,0 +1,32 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from metrics import score_prediction, strategy_profit
+
+
+def test_strategy_profit_no_days():
+    prediction_profit, hold_profit = strategy_profit([], [], 10)
+
+    assert len(prediction_profit) == 0
+    assert len(hold_profit) == 0
+
+
+def test_strategy_profit():
+    prediction_profit, hold_profit = strategy_profit([10.0, 11.0, 9.0, 12.0], [10.0, 12.0, 11.0, 13.0], 2)
+
+    np.testing.assert_allclose(prediction_profit, [0.0, 2.0, 2.0, 8.0])
+    np.testing.assert_allclose(hold_profit, [0.0, 2.0, -2.0, 4.0])
+
+
+def test_score_prediction_empty_test_window():
+    train = pd.DataFrame({'y': [1.0, 2.0, 3.0], 'yhat': [1.5, 2.0, 2.5]})
+    test = pd.DataFrame({'y': [], 'yhat': []})
+
+    metrics = score_prediction(train, test, nshares=100)
+
+    assert metrics.train_error == 1 / 3
+    assert math.isnan(metrics.test_error)
+    assert math.isnan(metrics.prediction_profit)
+    assert math.isnan(metrics.hold_profit)
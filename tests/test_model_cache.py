@@ -0,0 +1,27 @@
+from model_cache import ModelCache
+
+
+def test_invalidate_only_removes_that_ticker(tmp_path):
+    cache = ModelCache(cache_dir=str(tmp_path))
+
+    for symbol in ('BRK', 'BRK_B', 'MSFT'):
+        cache.put((symbol, 'window'), {'symbol': symbol})
+
+    cache.invalidate('BRK')
+
+    remaining = ModelCache(cache_dir=str(tmp_path))
+    assert remaining.get(('BRK', 'window')) is None
+    assert remaining.get(('BRK_B', 'window')) == {'symbol': 'BRK_B'}
+    assert remaining.get(('MSFT', 'window')) == {'symbol': 'MSFT'}
+    assert len(cache) == 2
+
+
+def test_invalidate_everything(tmp_path):
+    cache = ModelCache(cache_dir=str(tmp_path))
+    cache.put(('BRK', 'window'), 1)
+    cache.put(('BRK_B', 'window'), 2)
+
+    cache.clear()
+
+    assert len(cache) == 0
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from panel import PricePanel
+
+
+# A trades from the start; B only lists on the third day of the window
+def listing_panel():
+    dates = pd.bdate_range('2020-01-06', periods=5)
+    opens = np.array([[10.0, np.nan],
+                      [11.0, np.nan],
+                      [12.0, 50.0],
+                      [13.0, 60.0],
+                      [14.0, 70.0]])
+    return PricePanel(dates, ['A', 'B'], opens, opens.copy())
+
+
+def test_weights_skip_ticker_listing_mid_window():
+    panel = listing_panel()
+
+    np.testing.assert_allclose(panel.weights('equal'), [1.0, 0.0])
+    np.testing.assert_allclose(panel.weights('price'), [1.0, 0.0])
+
+
+def test_portfolio_returns_ignore_ticker_listing_mid_window():
+    panel = listing_panel()
+
+    returns = panel.portfolio_returns({'equal': 'equal', 'price': 'price'})
+
+    expected = panel.closes[:, 0] / 10.0 - 1
+    np.testing.assert_allclose(returns['equal'], expected)
+    np.testing.assert_allclose(returns['price'], expected)
+
+
+def test_weights_use_last_close_before_window():
+    panel = listing_panel()
+
+    # B did not open on the window's first day but closed the day before
+    panel.opens[3, 1] = np.nan
+
+    weights = panel.weights('price', start_date=panel.dates[3])
+    np.testing.assert_allclose(weights, [13.0 / 63.0, 50.0 / 63.0])
@@ -0,0 +1,42 @@
+import pickle
+
+import trends
+from model_cache import default_model_cache
+from stocker import Stocker
+from synthetic_prices import synthetic_stock
+
+
+def test_stocker_pickle_round_trip():
+    stocker = Stocker('SYNTH', stock=synthetic_stock(2), verbose=False)
+
+    copy = pickle.loads(pickle.dumps(stocker))
+
+    assert copy.symbol == stocker.symbol
+    assert copy.stock.equals(stocker.stock)
+    assert copy.trends_client is trends.default_trends_client
+    assert copy.model_cache is default_model_cache
+
+
+def test_stocker_pickle_leaves_out_model_cache():
+    stocker = Stocker('SYNTH', stock=synthetic_stock(2), verbose=False)
+    size = len(pickle.dumps(stocker))
+
+    # A model cached by another Stocker must not travel with this one
+    default_model_cache.put(('OTHER', 'window'), b'x' * 100000)
+    try:
+        assert len(pickle.dumps(stocker)) == size
+    finally:
+        default_model_cache.invalidate('OTHER')
+
+    stocker.model_cache = None
+    assert pickle.loads(pickle.dumps(stocker)).model_cache is None
+
+
+def test_trends_client_pickle_round_trip():
+    client = trends.TrendsClient(cache_dir=None)
+    client.limiter.acquire()
+
+    copy = pickle.loads(pickle.dumps(client))
+    copy.limiter.acquire()
+
+    assert copy.limiter.capacity == client.limiter.capacity
@@ -0,0 +1,214 @@
+# Trading sessions for the exchanges our holdings trade on
+# Each exchange's holidays are generated from its rules once per process and
+# kept as a numpy business-day calendar, so session checks and future dates
+# are vectorised lookups instead of per-row Python.
+# One-off closures (royal events, national days of mourning, ...) are not included.
+import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Years covered by the precomputed calendars
+FIRST_YEAR = 1970
+LAST_YEAR = 2100
+
+# Calendars used for the data sources and exchange codes we see
+CALENDAR_FOR_EXCHANGE = {'WIKI': 'NYSE', 'NYSE': 'NYSE', 'NASDAQ': 'NYSE', 'US': 'NYSE',
+                         'LSE': 'LSE', 'L': 'LSE', 'LON': 'LSE',
+                         'XETRA': 'XETRA', 'FSE': 'XETRA', 'DE': 'XETRA', 'FRA': 'XETRA',
+                         'SIX': 'SIX', 'SW': 'SIX', 'SWX': 'SIX'}
+
+# Monday to Friday, used for exchanges without holiday rules
+WEEKDAYS = 'WEEKDAYS'
+
+
+# Easter Sunday (anonymous Gregorian algorithm)
+def easter_sunday(year):
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+# The nth weekday (0 = Monday) of a month, n = -1 for the last one
+def nth_weekday(year, month, weekday, n):
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    last = next_month - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+# US rule: Saturday holidays move to Friday, Sunday ones to Monday
+def us_observed(date):
+    if date.weekday() == 5:
+        return date - datetime.timedelta(days=1)
+    if date.weekday() == 6:
+        return date + datetime.timedelta(days=1)
+    return date
+
+
+# UK rule: weekend holidays move to the next weekday
+def uk_substitute(date):
+    while date.weekday() >= 5:
+        date += datetime.timedelta(days=1)
+    return date
+
+
+def nyse_holidays(year):
+    easter = easter_sunday(year)
+    days = []
+
+    # New Year's Day is not moved back into December
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() != 5:
+        days.append(us_observed(new_year))
+
+    if year >= 1998:
+        days.append(nth_weekday(year, 1, 0, 3))                    # Martin Luther King Jr. Day
+    days.append(nth_weekday(year, 2, 0, 3))                        # Washington's Birthday
+    days.append(easter - datetime.timedelta(days=2))               # Good Friday
+    days.append(nth_weekday(year, 5, 0, -1))                       # Memorial Day
+    if year >= 2022:
+        days.append(us_observed(datetime.date(year, 6, 19)))       # Juneteenth
+    days.append(us_observed(datetime.date(year, 7, 4)))            # Independence Day
+    days.append(nth_weekday(year, 9, 0, 1))                        # Labor Day
+    days.append(nth_weekday(year, 11, 3, 4))                       # Thanksgiving
+    days.append(us_observed(datetime.date(year, 12, 25)))          # Christmas
+
+    return days
+
+
+def lse_holidays(year):
+    easter = easter_sunday(year)
+    days = [uk_substitute(datetime.date(year, 1, 1)),              # New Year's Day
+            easter - datetime.timedelta(days=2),                   # Good Friday
+            easter + datetime.timedelta(days=1),                   # Easter Monday
+            nth_weekday(year, 5, 0, -1),                           # Spring bank holiday
+            nth_weekday(year, 8, 0, -1)]                           # Summer bank holiday
+
+    if year >= 1978:
+        days.append(nth_weekday(year, 5, 0, 1))                    # Early May bank holiday
+
+    # Christmas and Boxing Day, each substituted onto the next free weekday
+    christmas = uk_substitute(datetime.date(year, 12, 25))
+    boxing_day = uk_substitute(max(datetime.date(year, 12, 26), christmas + datetime.timedelta(days=1)))
+    days += [christmas, boxing_day]
+
+    return days
+
+
+def xetra_holidays(year):
+    easter = easter_sunday(year)
+    return [datetime.date(year, 1, 1),                             # New Year's Day
+            easter - datetime.timedelta(days=2),                   # Good Friday
+            easter + datetime.timedelta(days=1),                   # Easter Monday
+            datetime.date(year, 5, 1),                             # Labour Day
+            datetime.date(year, 12, 24),                           # Christmas Eve
+            datetime.date(year, 12, 25),                           # Christmas Day
+            datetime.date(year, 12, 26),                           # Boxing Day
+            datetime.date(year, 12, 31)]                           # New Year's Eve
+
+
+def six_holidays(year):
+    easter = easter_sunday(year)
+    return [datetime.date(year, 1, 1),                             # New Year's Day
+            datetime.date(year, 1, 2),                             # Berchtold's Day
+            easter - datetime.timedelta(days=2),                   # Good Friday
+            easter + datetime.timedelta(days=1),                   # Easter Monday
+            datetime.date(year, 5, 1),                             # Labour Day
+            easter + datetime.timedelta(days=39),                  # Ascension Day
+            easter + datetime.timedelta(days=50),                  # Whit Monday
+            datetime.date(year, 8, 1),                             # Swiss National Day
+            datetime.date(year, 12, 24),                           # Christmas Eve
+            datetime.date(year, 12, 25),                           # Christmas Day
+            datetime.date(year, 12, 26),                           # St. Stephen's Day
+            datetime.date(year, 12, 31)]                           # New Year's Eve
+
+
+HOLIDAY_RULES = {'NYSE': nyse_holidays,
+                 'LSE': lse_holidays,
+                 'XETRA': xetra_holidays,
+                 'SIX': six_holidays,
+                 WEEKDAYS: lambda year: []}
+
+
+# Calendar name for an exchange or data source code, weekdays if unknown
+def calendar_for_exchange(exchange):
+    if exchange is None:
+        return WEEKDAYS
+
+    exchange = exchange.upper()
+    if exchange in HOLIDAY_RULES:
+        return exchange
+
+    return CALENDAR_FOR_EXCHANGE.get(exchange, WEEKDAYS)
+
+
+# Holidays that fall on weekdays, as a sorted datetime64[D] array
+@lru_cache(maxsize=None)
+def holiday_array(calendar):
+    rule = HOLIDAY_RULES[calendar_for_exchange(calendar)]
+
+    days = set()
+    for year in range(FIRST_YEAR, LAST_YEAR + 1):
+        days.update(day for day in rule(year) if day.weekday() < 5)
+
+    return np.array(sorted(days), dtype='datetime64[D]')
+
+
+# numpy business-day calendar for an exchange, built once per process
+@lru_cache(maxsize=None)
+def busday_calendar(calendar):
+    return np.busdaycalendar(weekmask='1111100', holidays=holiday_array(calendar))
+
+
+def _as_days(dates):
+    return np.asarray(pd.to_datetime(dates).values, dtype='datetime64[D]')
+
+
+# Boolean array: which of the dates are trading sessions
+def is_session(dates, calendar):
+    return np.is_busday(_as_days(dates), busdaycal=busday_calendar(calendar_for_exchange(calendar)))
+
+
+# Trading sessions from start_date to end_date inclusive
+def sessions(calendar, start_date, end_date):
+    days = np.arange(np.datetime64(pd.Timestamp(start_date).date(), 'D'),
+                     np.datetime64(pd.Timestamp(end_date).date(), 'D') + 1)
+    return pd.DatetimeIndex(days[is_session(days, calendar)].astype('datetime64[ns]'))
+
+
+# The next n trading sessions strictly after date
+def next_sessions(calendar, date, n):
+    calendar = busday_calendar(calendar_for_exchange(calendar))
+    last = np.busday_offset(np.datetime64(pd.Timestamp(date).date(), 'D'), 0, roll='backward', busdaycal=calendar)
+    days = np.busday_offset(last, np.arange(1, n + 1), busdaycal=calendar)
+    return pd.DatetimeIndex(days.astype('datetime64[ns]'))
+
+
+# Frame of ds dates for a prediction: the history (if wanted) then the
+# sessions in the days calendar days after its last date
+def future_frame(history_ds, days, calendar, include_history=True):
+    last_date = pd.Timestamp(history_ds.max())
+    future = sessions(calendar, last_date + pd.DateOffset(days=1), last_date + pd.DateOffset(days=days))
+
+    if include_history:
+        future = np.concatenate([pd.to_datetime(history_ds).values, future.values])
+
+    return pd.DataFrame({'ds': pd.to_datetime(future)})
+
+
+# Rows of a frame whose date column falls on a session
+def filter_sessions(dataframe, calendar, column='ds'):
+    return dataframe[is_session(dataframe[column], calendar)]
@@ -0,0 +1,229 @@
+# Google Trends data for Stocker, cached on disk and rate limited
+# One pytrends session is shared by every request in the process. Results are
+# stored per (term, timeframe, geo, gprop), so repeating an analysis over the
+# same window makes no network calls. Several terms can be packed into one
+# payload (Google allows five) to cut the number of requests further.
+import os
+import time
+import pickle
+import hashlib
+import datetime
+import threading
+
+import pandas as pd
+
+from lazy_modules import lazy_import
+
+# Imported when the first session is created
+pytrends_request = lazy_import('pytrends.request')
+
+# Default location of the cache, next to the price store
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'trends')
+
+# Most keywords Google accepts in one payload
+MAX_BATCH_SIZE = 5
+
+
+# Token bucket: allows bursts of up to capacity requests, refilled at
+# rate tokens per second. acquire blocks until a token is free.
+class TokenBucket():
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                time.sleep((1 - self.tokens) / self.rate)
+
+    # Locks cannot be pickled, so a copy gets its own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+# Explicit 'YYYY-MM-DD YYYY-MM-DD' timeframes that ended a few days ago
+# are final; anything else ('today 5-y', 'now 7-d', ...) keeps moving
+def is_closed_timeframe(timeframe, settle_days=3):
+    parts = timeframe.split()
+    if len(parts) != 2:
+        return False
+
+    try:
+        end = datetime.datetime.strptime(parts[1], '%Y-%m-%d').date()
+    except ValueError:
+        return False
+
+    return end <= datetime.date.today() - datetime.timedelta(days=settle_days)
+
+
+# Fetches interest over time and related queries through one shared
+# session, reading and writing a pickle file per term
+class TrendsClient():
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, requests_per_minute=10, burst=5,
+                 max_age_days=1, hl='en-US', tz=360):
+
+        # None keeps results in memory only
+        self.cache_dir = cache_dir
+
+        # Results for moving timeframes are refetched after this long
+        self.max_age_days = max_age_days
+
+        self.hl = hl
+        self.tz = tz
+
+        self.limiter = TokenBucket(requests_per_minute / 60, burst)
+
+        self._session = None
+        self._memory = {}
+
+        # Payloads sent to Google, for checking the cache is doing its job
+        self.requests = 0
+
+    # A copy starts a new session when it needs one
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_session'] = None
+        return state
+
+    # Session created on first use and reused afterwards
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = pytrends_request.TrendReq(hl=self.hl, tz=self.tz)
+        return self._session
+
+    def path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, '%s.pkl' % digest)
+
+    # Cached entry for key, None if missing or stale
+    def _read(self, key):
+        if key in self._memory:
+            fetched, entry = self._memory[key]
+        elif self.cache_dir is not None and os.path.exists(self.path(key)):
+            try:
+                with open(self.path(key), 'rb') as f:
+                    fetched, entry = pickle.load(f)
+            except Exception:
+                return None
+            self._memory[key] = (fetched, entry)
+        else:
+            return None
+
+        age = datetime.datetime.now() - fetched
+        if not is_closed_timeframe(key[1]) and age > datetime.timedelta(days=self.max_age_days):
+            return None
+
+        return entry
+
+    def _write(self, key, entry):
+        record = (datetime.datetime.now(), entry)
+        self._memory[key] = record
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self.path(key)
+
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(record, f)
+            os.replace(path + '.tmp', path)
+
+    # One payload for up to five terms
+    # Google scales every term in a payload against the most searched one,
+    # so each series is rescaled to its own peak of 100 before it is cached
+    # to match what a request for the term alone returns
+    def _request(self, terms, timeframe, geo, gprop):
+        self.limiter.acquire()
+        self.requests += 1
+
+        self.session.build_payload(terms, cat=0, timeframe=timeframe, geo=geo, gprop=gprop)
+        interest = self.session.interest_over_time()
+        related = self.session.related_queries()
+
+        entries = {}
+        for term in terms:
+            if term in interest.columns:
+                series = interest[term].astype(float)
+                if series.max() > 0:
+                    series = 100 * series / series.max()
+            else:
+                series = pd.Series(dtype=float, name=term)
+
+            entries[term] = {'interest': series,
+                             'related': related.get(term, {'top': None, 'rising': None})}
+
+        return entries
+
+    # Interest and related queries for each term: term -> {'interest': Series,
+    # 'related': {'top': frame, 'rising': frame}}. Only uncached terms are
+    # requested, batch_size of them per payload (1 keeps Google's own scaling).
+    def fetch(self, terms, timeframe, geo='', gprop='', batch_size=MAX_BATCH_SIZE):
+        if isinstance(terms, str):
+            terms = [terms]
+
+        batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+
+        results = {}
+        missing = []
+        for term in dict.fromkeys(terms):
+            entry = self._read((term, timeframe, geo, gprop))
+            if entry is None:
+                missing.append(term)
+            else:
+                results[term] = entry
+
+        for start in range(0, len(missing), batch_size):
+            for term, entry in self._request(missing[start:start + batch_size], timeframe, geo, gprop).items():
+                self._write((term, timeframe, geo, gprop), entry)
+                results[term] = entry
+
+        return results
+
+    # Interest over time for the terms as one frame with a column per term
+    def interest_over_time(self, terms, timeframe, geo='', gprop='', batch_size=MAX_BATCH_SIZE):
+        if isinstance(terms, str):
+            terms = [terms]
+
+        entries = self.fetch(terms, timeframe, geo, gprop, batch_size)
+        return pd.DataFrame({term: entries[term]['interest'] for term in terms})
+
+    # Related queries in the pytrends shape: term -> {'top': ..., 'rising': ...}
+    def related_queries(self, terms, timeframe, geo='', gprop='', batch_size=MAX_BATCH_SIZE):
+        if isinstance(terms, str):
+            terms = [terms]
+
+        entries = self.fetch(terms, timeframe, geo, gprop, batch_size)
+        return {term: entries[term]['related'] for term in terms}
+
+    # Forget cached results, on disk as well
+    def clear(self):
+        self._memory.clear()
+
+        if self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+# Client shared by every Stocker in the process
+default_trends_client = TrendsClient()